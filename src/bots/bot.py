@@ -1,34 +1,34 @@
+from concurrent.futures import Future
 import re
+import sys
 import time
 
 from msg.slackpostedmessage import SlackPostedMessage
 
 USER_RE_ANCHORED = re.compile(r'^<@(U[^>|]+)(\|[^>]+)?>')
 USER_RE = re.compile(r'<@(U[^>|]+)(\|[^>]+)?>')
+USER_ID_RE = re.compile(r'^[UW][A-Z0-9]+$')
 
 def lookup_user(connection, id):
-    # TODO
-    return id #None
-    users = connection.server.users
-
-    if type(id) == str:
-        id = id.decode('utf-8')
-
-    for u in users:
-        # users may be either iterable<User> or dictionary<unicode, User>
-        if type(u) == str:
-            u = users[u]
-
-        if hasattr(u, 'id') and u.id == id:
-            return u.name.encode('utf-8')
-    return None
+    users = getattr(connection, "users", None)
+    if users is None:
+        # no user directory (e.g. running offline), ids are the best we have
+        return id
+    if not USER_ID_RE.match(id):
+        # a channel or plain name, don't bother slack about it
+        return None
+    return users.lookup(id)
 
 class Bot():
+    # only see reactions to messages in live_messages, rather than every reaction
+    registered_reactions_only = False
+
     def __init__(self, slackmonitor, botname):
         self.botname = botname
         self.slackmonitor = slackmonitor
         self.channel = None
         self.icon_emoji = None
+        self.live_messages = dict() # (channel id, ts) => whatever the message is for
 
     def botname_for_channel(self, channel):
         return self.botname
@@ -36,10 +36,21 @@ class Bot():
     def botemoji_for_channel(self, channel):
         return self.icon_emoji
 
-    def lookup_user(self, id, alt = None):
+    def user_id(self, id):
+        """
+        The bare id from id or a "<@U...>" mention - what bots that keep users
+        (and mention them back) should hold onto, rather than their names
+        """
         match = USER_RE_ANCHORED.search(id)
         if match is not None:
-            id = match.group(1)
+            return match.group(1)
+        return id
+
+    def lookup_user(self, id, alt = None):
+        """
+        The user's name, for display
+        """
+        id = self.user_id(id)
 
         name = lookup_user(self.slackmonitor, id)
         if name:
@@ -51,7 +62,11 @@ class Bot():
     #        return self.slackmonitor.server.channels.find(channel)
     #    return self.channel
 
-    def send_message(self, text, to_channel = None) -> SlackPostedMessage:
+    def send_message(self, text, to_channel = None) -> "Future[SlackPostedMessage]":
+        """
+        Queues text for posting, returning a future for the posted message
+        (callers that need its timestamp should wait on the result)
+        """
         #channel = self.resolve_channel(to_channel)
         channel = to_channel if to_channel is not None else self.channel
 
@@ -59,7 +74,8 @@ class Bot():
             raise ValueError("no channel to post to")
 
         # post as BOT_NAME instead of the current user
-        response = self.slackmonitor.webclient.chat_postMessage(
+        return self.slackmonitor.outbound.post_message(
+            lambda response: SlackPostedMessage(response["channel"], response["ts"], text),
             channel = channel["id"],
             text = text,
             username = self.botname_for_channel(channel["name"]),
@@ -67,15 +83,14 @@ class Bot():
             as_user = False
         )
 
-        return SlackPostedMessage(response["channel"], response["ts"], text)
-
     def update_message(self, text, *, original_message=None, original_channel=None, original_timestamp=None):
         channel = original_channel or original_message["channel"]
         timestamp = original_timestamp or original_message["timestamp"]
 
         #channel = self.resolve_channel(channel)
 
-        self.slackmonitor.webclient.chat_update(
+        return self.slackmonitor.outbound.update_message(
+            lambda response: None,
             channel=channel["id"],
             ts=timestamp,
             username=self.botname_for_channel(channel["name"]),
@@ -87,6 +102,41 @@ class Bot():
     def send_list(self, prefix, list):
         self.send_message("{}: {}".format(prefix, ', '.join(list)))
 
+    def register_message(self, channel_id, timestamp, owner):
+        """
+        Records that reactions to the message at (channel_id, timestamp) are for owner
+        """
+        key = (channel_id, timestamp)
+        existing = self.live_messages.get(key)
+        if existing is not None and existing is not owner:
+            print("internal error: {} already registered to {}".format(key, existing), file=sys.stderr)
+        self.live_messages[key] = owner
+
+    def unregister_message(self, channel_id, timestamp, owner):
+        """
+        Stops routing reactions to the message at (channel_id, timestamp), if
+        they're still owner's
+        """
+        key = (channel_id, timestamp)
+        if self.live_messages.get(key) is owner:
+            del self.live_messages[key]
+
+    def message_owner(self, channel_id, timestamp):
+        owner = self.live_messages.get((channel_id, timestamp))
+        if owner is None:
+            # registered without knowing its channel (e.g. loaded from old state)
+            owner = self.live_messages.get((None, timestamp))
+        return owner
+
+    def wants_reaction(self, channel_id, timestamp):
+        """
+        Whether a reaction to the message at (channel_id, timestamp) should be
+        passed to handle_reaction() / handle_unreaction()
+        """
+        if not self.registered_reactions_only:
+            return True
+        return self.message_owner(channel_id, timestamp) is not None
+
     def handle_message(self, message):
         return False # abstract
 
@@ -105,6 +155,24 @@ class Bot():
     def set_current_channel(self, channel):
         self.channel = channel
 
+    def call_at(self, when, fn):
+        """
+        Runs fn() at the datetime `when`, alongside this bot's other handlers
+
+        Returns a timer with a cancel() method, or None if we're not connected
+        """
+        if self.slackmonitor is None:
+            return None
+        return self.slackmonitor.call_at(self, when.timestamp(), fn)
+
+    def call_later(self, delay, fn):
+        """
+        Runs fn() in `delay` seconds, as call_at()
+        """
+        if self.slackmonitor is None:
+            return None
+        return self.slackmonitor.call_at(self, time.time() + delay, fn)
+
     def teardown(self):
         pass
 
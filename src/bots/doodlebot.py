@@ -163,8 +163,8 @@ class DoodleBot(Bot):
             return False
 
         try:
-            # lookup message.user
-            message.user = self.lookup_user(message.user)
+            # kept by id, so "<@...>" mentions work
+            message.user = self.user_id(message.user)
             self.handle_command(
                     message,
                     '' if len(tokens) < 2 else tokens[1],
@@ -188,13 +188,14 @@ class LunchBot(Bot):
                 reverse=True)
 
     def member_names(self, channel):
-        return [self.lookup_user(id) for id in channel.members]
+        # ids, as lunchers are kept and mentioned by
+        return [self.user_id(id) for id in channel.members]
 
     def suggest(self, channel, optional_lunchers):
-        # must convert to names so we can do comparisons with existing lunchers
+        # must convert to ids so we can do comparisons with existing lunchers
         luncher_tokens = optional_lunchers.strip().split(' ')
         if len(optional_lunchers) and len(luncher_tokens):
-            member_names = [self.lookup_user(l, '') for l in luncher_tokens]
+            member_names = [self.user_id(l) for l in luncher_tokens]
 
             # if member_names contains '', we failed to parse a user
             try:
@@ -284,7 +285,7 @@ class LunchBot(Bot):
 
         # handle both raw names and @names,
         # which are passed to us "<@U...>"
-        resolved_luncher = self.lookup_user(luncher)
+        resolved_luncher = self.user_id(luncher)
         if resolved_luncher == luncher:
             # was passed as a raw name - ensure they exist in the channel
             if luncher not in self.member_names(message.channel):
@@ -388,8 +389,8 @@ class LunchBot(Bot):
             return False
 
         try:
-            # lookup message.user
-            message.user = self.lookup_user(message.user)
+            # ratings and mentions are by id
+            message.user = self.user_id(message.user)
             self.handle_command(message, tokens[1] if len(tokens) > 1 else '', ' '.join(tokens[2:]))
         except Exception as e:
             r = random.randint(1, 2)
@@ -0,0 +1,90 @@
+import os
+import random
+import sys
+
+CONTROVERSIAL_PREFIX = "(controversial) "
+CHAMP_SUFFIX = "-champ"
+
+class BanterStore:
+    """
+    Banter lines from a file of "type: message" lines, parsed once into
+    buckets keyed by (type, champ, controversial)
+
+    The file's mtime is checked on each lookup, and it's re-parsed only when
+    that changes.
+    """
+    def __init__(self, path, known_types = ()):
+        self.path = path
+        self.known_types = known_types
+        self.mtime = None
+        self.buckets = {} # (type, champ, controversial) => [msg, ...]
+
+    def refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            print("exception loading banter: {}".format(e), file=sys.stderr)
+            self.mtime = None
+            self.buckets = {}
+            return
+
+        if mtime != self.mtime:
+            self.load()
+            self.mtime = mtime
+
+    def load(self):
+        buckets = {}
+        type_warned = set()
+
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    line = line.rstrip("\n")
+                    if len(line) == 0 or line[0] == "#":
+                        continue
+                    tokens = line.split(":", 1)
+                    if len(tokens) != 2:
+                        print("invalid banter line %s" % line, file=sys.stderr)
+                        continue
+
+                    bant_type = tokens[0]
+
+                    is_controversial = bant_type.startswith(CONTROVERSIAL_PREFIX)
+                    if is_controversial:
+                        bant_type = bant_type[len(CONTROVERSIAL_PREFIX):]
+
+                    is_champ = bant_type.endswith(CHAMP_SUFFIX)
+                    if is_champ:
+                        bant_type = bant_type[:-len(CHAMP_SUFFIX)]
+
+                    if bant_type not in self.known_types and bant_type not in type_warned:
+                        print("unknown banter type \"%s\"" % bant_type, file=sys.stderr)
+                        type_warned.add(bant_type)
+
+                    key = (bant_type, is_champ, is_controversial)
+                    buckets.setdefault(key, []).append(tokens[1].strip())
+        except IOError as e:
+            print("exception loading banter: {}".format(e), file=sys.stderr)
+
+        self.buckets = buckets
+
+    def pick(self, type, for_champ = False, allow_controversial = False):
+        """
+        A random message of the given type, or None if there are none
+        """
+        self.refresh()
+
+        candidates = [self.buckets.get((type, False, False), [])]
+        if for_champ:
+            candidates.append(self.buckets.get((type, True, False), []))
+        if allow_controversial:
+            candidates.append(self.buckets.get((type, False, True), []))
+            if for_champ:
+                candidates.append(self.buckets.get((type, True, True), []))
+
+        r = random.randrange(sum(map(len, candidates)) or 1)
+        for msgs in candidates:
+            if r < len(msgs):
+                return msgs[r]
+            r -= len(msgs)
+        return None
@@ -0,0 +1,75 @@
+import unittest
+
+import sys
+
+from os import path
+fcwd = path.dirname(__file__)
+sys.path.insert(0, path.abspath("{}/../../".format(fcwd)))
+
+import os
+import tempfile
+import time
+from bots.ps4.banter import BanterStore
+
+BANTER = """# comment
+joined: welcome
+joined-champ: welcome back, champ
+(controversial) joined: oi
+(controversial) joined-champ: oi champ
+created: gg
+"""
+
+class TestBanterStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "banter.txt")
+        with open(self.path, "w") as f:
+            f.write(BANTER)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def picks(self, store, type, **kwargs):
+        return set(store.pick(type, **kwargs) for _ in range(200))
+
+    def test_banter_filtered_by_champ_and_controversial(self):
+        store = BanterStore(self.path, ["joined", "created"])
+
+        self.assertEqual(self.picks(store, "joined"), set(["welcome"]))
+        self.assertEqual(self.picks(store, "joined", for_champ = True),
+                set(["welcome", "welcome back, champ"]))
+        self.assertEqual(self.picks(store, "joined", allow_controversial = True),
+                set(["welcome", "oi"]))
+        self.assertEqual(self.picks(store, "joined", for_champ = True, allow_controversial = True),
+                set(["welcome", "welcome back, champ", "oi", "oi champ"]))
+        self.assertIsNone(store.pick("kickoff"))
+
+    def test_banter_reloaded_when_file_changes(self):
+        store = BanterStore(self.path, ["joined", "created"])
+        self.assertEqual(store.pick("created"), "gg")
+
+        with open(self.path, "w") as f:
+            f.write("created: good game\n")
+        os.utime(self.path, (store.mtime + 10, store.mtime + 10))
+
+        self.assertEqual(store.pick("created"), "good game")
+        self.assertIsNone(store.pick("joined"))
+
+    def test_banter_benchmark(self):
+        with open(self.path, "w") as f:
+            for i in range(500):
+                f.write("joined: welcome {}\n".format(i))
+                f.write("(controversial) created-champ: gg {}\n".format(i))
+
+        store = BanterStore(self.path, ["joined", "created"])
+        calls = 200
+
+        start = time.perf_counter()
+        picks = set(store.pick("joined", for_champ = True, allow_controversial = True) for _ in range(calls))
+        stored = (time.perf_counter() - start) / calls
+
+        print("banter pick: {:.1f}us per call".format(stored * 1e6), file=sys.stderr)
+        self.assertTrue(picks <= set("welcome {}".format(i) for i in range(500)))
+
+if __name__ == '__main__':
+    unittest.main()
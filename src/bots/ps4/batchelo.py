@@ -0,0 +1,89 @@
+from itertools import product
+
+from .elo import calculate_rankings, default_k_factor, initial_ranking, scrub_modifier
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class BatchRankings:
+    """
+    The outcome of replaying a set of games under several elo parameters
+
+    rankings maps (k_factor, scrub_modifier) => { player_id: ranking },
+    games_played maps player_id => count (the same whatever the parameters)
+    """
+    def __init__(self, rankings, games_played):
+        self.rankings = rankings
+        self.games_played = games_played
+
+def calculate_rankings_batch(games, k_factors, modifiers = (scrub_modifier,)):
+    """
+    Replays the games (elo.Game) once for every combination of k_factor and
+    scrub modifier, using numpy if it's available
+    """
+    games = list(games)
+    params = list(product(k_factors, modifiers))
+    if numpy is None:
+        return _rankings_python(games, params)
+    return _rankings_numpy(games, params)
+
+def _rankings_python(games, params):
+    rankings = {}
+    games_played = {}
+    for k_factor, modifier in params:
+        players = calculate_rankings(games, k_factor, modifier)
+        rankings[(k_factor, modifier)] = { id: p.ranking for id, p in players.items() }
+        games_played = { id: p.games_played for id, p in players.items() }
+    return BatchRankings(rankings, games_played)
+
+def _rankings_numpy(games, params):
+    # encode each game as indices into the players, with the winners first
+    ids = {}
+    def index_of(player_id):
+        return ids.setdefault(player_id, len(ids))
+
+    encoded = []
+    for game in games:
+        winners = [index_of(p) for p in game.teams[game.winning_team_index]]
+        losers = [index_of(p) for i, team in enumerate(game.teams)
+                if i != game.winning_team_index for p in team]
+        scrubs = [game.scrubs.get(p, 0) for p in game.teams[game.winning_team_index]]
+        encoded.append((
+            numpy.array(winners + losers, dtype = int),
+            len(winners),
+            numpy.array(scrubs + [0] * len(losers), dtype = float)))
+
+    k_factors = numpy.array([k or default_k_factor for k, _ in params], dtype = float)[:, None]
+    modifiers = numpy.array([m for _, m in params], dtype = float)[:, None]
+    ratings = numpy.full((len(params), len(ids)), initial_ranking, dtype = float)
+    games_played = numpy.zeros(len(ids), dtype = int)
+
+    def team_mean(team):
+        if team.shape[1] == 0:
+            return numpy.zeros(team.shape[0])
+        return team.sum(axis = 1) / team.shape[1]
+
+    for players, n_winners, scrubs in encoded:
+        current = ratings[:, players]
+        winners_mean = team_mean(current[:, :n_winners])
+        losers_mean = team_mean(current[:, n_winners:])
+
+        # winners are up against the losers' average, and vice versa
+        result = numpy.zeros(len(players))
+        result[:n_winners] = 1
+        other = numpy.where(result == 1, losers_mean[:, None], winners_mean[:, None])
+
+        expected = 1 / (1 + 10 ** ((other - current) / 400.0))
+        delta = numpy.round(k_factors * (result - expected))
+        delta = numpy.where(delta == 0, numpy.where(result == 1, 1, -1), delta)
+
+        numpy.add.at(ratings, (slice(None), players), numpy.round(delta * modifiers ** scrubs))
+        numpy.add.at(games_played, players, 1)
+
+    player_ids = list(ids)
+    rankings = {}
+    for i, param in enumerate(params):
+        rankings[param] = { id: int(r) for id, r in zip(player_ids, ratings[i]) }
+    return BatchRankings(rankings, dict(zip(player_ids, map(int, games_played))))
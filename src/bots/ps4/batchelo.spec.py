@@ -0,0 +1,55 @@
+import unittest
+
+import sys
+
+from os import path
+fcwd = path.dirname(__file__)
+sys.path.insert(0, path.abspath("{}/../../".format(fcwd)))
+
+import random
+from bots.ps4 import batchelo
+from bots.ps4.elo import Game, calculate_rankings
+
+def random_games(count):
+    rand = random.Random(1234)
+    players = ["p{}".format(i) for i in range(12)]
+
+    games = []
+    for _ in range(count):
+        picked = rand.sample(players, rand.choice([2, 4, 6, 8]))
+        half = len(picked) // 2
+        winners = rand.randrange(2)
+        scrubs = { p: rand.randrange(1, 3) for p in picked if rand.random() < 0.1 }
+        games.append(Game([picked[:half], picked[half:]], winners, scrubs))
+    return games
+
+class TestBatchElo(unittest.TestCase):
+    def assertMatchesSingleRuns(self, batch, games, k_factors, modifiers):
+        for k_factor in k_factors:
+            for modifier in modifiers:
+                expected = calculate_rankings(games, k_factor, modifier)
+                self.assertEqual(batch.rankings[(k_factor, modifier)],
+                        { id: p.ranking for id, p in expected.items() })
+                self.assertEqual(batch.games_played,
+                        { id: p.games_played for id, p in expected.items() })
+
+    def test_batch_matches_single_runs(self):
+        games = random_games(300)
+        k_factors = [None, 10, 20, 30, 40]
+        modifiers = [1.1, 1.5]
+
+        batch = batchelo.calculate_rankings_batch(games, k_factors, modifiers)
+        self.assertMatchesSingleRuns(batch, games, k_factors, modifiers)
+
+    def test_batch_without_numpy(self):
+        numpy = batchelo.numpy
+        batchelo.numpy = None
+        try:
+            games = random_games(50)
+            batch = batchelo.calculate_rankings_batch(games, [10, 40])
+            self.assertMatchesSingleRuns(batch, games, [10, 40], [1.1])
+        finally:
+            batchelo.numpy = numpy
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,12 @@
 import unittest
+from concurrent.futures import Future
 
 import sys
+import sqlite3 # these need the real datetime
+try:
+	import numpy # optional
+except ImportError:
+	pass
 sys.modules['datetime'] = __import__('mock_datetime')
 
 from os import path
@@ -9,8 +15,11 @@ sys.path.insert(0, path.abspath("{}/../".format(fcwd)))
 sys.path.insert(0, path.abspath("{}/../../".format(fcwd)))
 
 import datetime
+import os
+import tempfile
 from bots.ps4.parsing import parse_game_initiation, today_at, TooManyTimeSpecs
 from bots.ps4bot import Game, PS4Bot, GameStates
+import bots.ps4bot as ps4bot_module
 from bots.ps4.history import PS4History
 from msg.slackmessage import SlackMessage
 from msg.slackpostedmessage import SlackPostedMessage
@@ -18,6 +27,14 @@ from msg.slackreaction import SlackReaction
 
 posted_message_when = today_at(11, 43)
 
+def posted_at(n):
+	"""
+	When the n'th message a test posts went out: posted_message_when for the
+	first and a minute apart after that, so each has its own (channel, ts)
+	"""
+	minutes = 11 * 60 + 43 + n
+	return today_at(minutes // 60 % 24, minutes % 60)
+
 def parse(time, hour = None, minute = None):
 	got = parse_game_initiation(time, "channel")
 	if not got:
@@ -167,8 +184,13 @@ class TestGame(unittest.TestCase):
 def noop(*args):
 	pass
 
-class DummyChannel:
+class DummyTimer:
+	def cancel(self):
+		pass
+
+class DummyChannel(dict):
 	def __init__(self, name):
+		dict.__init__(self, id = "C-" + name, name = name)
 		self.name = name
 
 def dummy_load_banter(type, *rest, **restkw):
@@ -201,17 +223,23 @@ class TestPS4Bot(unittest.TestCase):
 		assert self.initialised
 
 		self.messages = []
+		posts = [0]
 
 		def send_message_stub(msg, to_channel = None):
 			self.messages.append(msg)
-			return SlackPostedMessage(to_channel or "?", posted_message_when, msg)
+			posted = Future()
+			if to_channel is None and ps4bot.channel is not None:
+				to_channel = ps4bot.channel["id"]
+			posted.set_result(SlackPostedMessage(to_channel or "?", posted_at(posts[0]), msg))
+			posts[0] += 1
+			return posted
 
 		ps4bot = PS4Bot(None, "ps4bot", load=False)
 		ps4bot.send_message = send_message_stub
 
 		ps4bot.save = noop
 		ps4bot.load = staticmethod(noop)
-		ps4bot.lookup_user = lambda u: u
+		ps4bot.user_id = lambda u: u
 		ps4bot.update_message = lambda text, **rest: None
 		ps4bot.load_banter = dummy_load_banter
 
@@ -368,10 +396,27 @@ class TestPS4Bot(unittest.TestCase):
 		self.assertEqual(len(self.messages), 1)
 		self.assertTrue("is straight after" in self.messages[0])
 
+	def test_ps4bot_game_states_advance_on_deadline(self):
+		dummychannel = DummyChannel("games")
+		ps4bot = self.create_ps4bot()
+
+		# "current time" is 9:00, so only the 9:04 game is within its kickoff notice
+		ps4bot.handle_message(SlackMessage("ps4bot test game at 9:04", "user", dummychannel, None, None, None, None))
+		ps4bot.handle_message(SlackMessage("ps4bot test game at 11:00", "user", dummychannel, None, None, None, None))
+		soon, later = ps4bot.games
+
+		self.assertEqual(ps4bot.update_game_states(), [soon])
+		self.assertEqual(soon.state, GameStates.active)
+		self.assertEqual(later.state, GameStates.scheduled)
+
+		# nothing else is due
+		self.assertEqual(ps4bot.update_game_states(), [])
+
 	def test_ps4bot_stats_sync(self):
 		channel_name = "games"
 		dummychannel = DummyChannel(channel_name)
 		ps4bot = self.create_ps4bot()
+		ps4bot.set_current_channel(dummychannel)
 
 		# 8:45 is 15 minutes before "current time"
 		ps4bot.handle_message(SlackMessage("ps4bot test game at 8:45", "user", dummychannel, None, None, None, None))
@@ -395,5 +440,94 @@ class TestPS4Bot(unittest.TestCase):
 		ps4bot.handle_reaction(reaction)
 		self.assertEqual(len(self.messages), 0)
 
+		records = []
+		ps4bot.history.record = lambda *tokens: records.append(tokens[0])
+		ps4bot.handle_unreaction(SlackReaction("+1", "tim", dummychannel, posted_message_when, None))
+		self.assertEqual(ps4bot.history.games[0].players, ["user"])
+		self.assertEqual(records, ["remove-player"])
+
+		# same timestamp, but another channel's message
+		ps4bot.handle_reaction(SlackReaction("+1", "tim", DummyChannel("fifa"), posted_message_when, None))
+		self.assertEqual(ps4bot.games[0].players, ["user"])
+
+	def test_ps4bot_unregisters_only_its_own_message(self):
+		ps4bot = self.create_ps4bot()
+		old, new = object(), object()
+		ps4bot.register_message("C-games", posted_message_when, new)
+
+		# something stale giving up the same message leaves it with its owner
+		ps4bot.unregister_message("C-games", posted_message_when, old)
+		self.assertIs(ps4bot.message_owner("C-games", posted_message_when), new)
+
+		ps4bot.unregister_message("C-games", posted_message_when, new)
+		self.assertIsNone(ps4bot.message_owner("C-games", posted_message_when))
+
+	def test_ps4bot_stats_elo_sweep(self):
+		dummychannel = DummyChannel("games")
+		ps4bot = self.create_ps4bot()
+
+		for i in range(3):
+			when = today_at(9, i)
+			game = Game(when, "desc", "games", "p1", SlackPostedMessage("games", when, None), 4, 30, None, False)
+			game.add_player("p2")
+			ps4bot.history.add_game(game)
+			ps4bot.history.register_stat(when, "p1", "p2", False, "stat.win")
+
+		ps4bot.handle_message(SlackMessage("ps4bot stats k=10..20", "user", dummychannel, None, None, None, None))
+
+		self.assertEqual(len(self.messages), 1)
+		header, _, p1, p2 = self.messages[0].split("\n")
+		self.assertEqual(header.split()[-5:], ["k=10", "|", "k=15", "|", "k=20"])
+		self.assertIn("<@p1>", p1)
+		self.assertEqual(p1.split("|")[1:], [" 1515? ", " 1522? ", " 1528?"])
+		self.assertIn("1485?", p2)
+
+	def test_ps4bot_stats_rejects_long_history(self):
+		dummychannel = DummyChannel("games")
+		ps4bot = self.create_ps4bot()
+
+		ps4bot.handle_message(SlackMessage("ps4bot stats h=30", "user", dummychannel, None, None, None, None))
+		self.assertEqual(self.messages, [":warning: ere <@user>: only the last 20 games are kept, h=20 at most"])
+
+	def test_ps4bot_load_limits_saved_history_length(self):
+		ps4bot = self.create_ps4bot()
+
+		with tempfile.TemporaryDirectory() as tmp:
+			save_file = ps4bot_module.SAVE_FILE
+			ps4bot_module.SAVE_FILE = os.path.join(tmp, "games")
+			try:
+				with open(ps4bot_module.SAVE_FILE, "w") as f:
+					print("stats games 1500000000.000100 - h=30,k=10", file=f)
+				PS4Bot.load(ps4bot)
+			finally:
+				ps4bot_module.SAVE_FILE = save_file
+
+		parameters = ps4bot.latest_stats_table["games"].parameters
+		self.assertEqual((parameters["h"], parameters["k"]), (20, 10))
+
+	def test_ps4bot_saves_are_written_behind(self):
+		ps4bot = self.create_ps4bot()
+		timers = []
+		ps4bot.call_later = lambda delay, fn: timers.append(fn) or DummyTimer()
+
+		with tempfile.TemporaryDirectory() as tmp:
+			save_file = ps4bot_module.SAVE_FILE
+			ps4bot_module.SAVE_FILE = os.path.join(tmp, "games")
+			try:
+				for _ in range(3):
+					PS4Bot.save(ps4bot)
+				self.assertEqual(len(timers), 1)
+				self.assertEqual(ps4bot.saves_coalesced, 2)
+				self.assertFalse(os.path.exists(ps4bot_module.SAVE_FILE))
+
+				timers[0]()
+				self.assertTrue(os.path.exists(ps4bot_module.SAVE_FILE))
+				self.assertFalse(ps4bot.dirty)
+
+				PS4Bot.save(ps4bot)
+				self.assertEqual(len(timers), 2)
+			finally:
+				ps4bot_module.SAVE_FILE = save_file
+
 if __name__ == '__main__':
 	unittest.main()
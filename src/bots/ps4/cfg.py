@@ -1,7 +1,13 @@
+import config
 from config import channel_max_players
 
 PLAY_TIME = 25
 GAME_FOLLOWON_TIME = 5
+GAME_KICKOFF_NOTICE = 5 # minutes before a game's start that it's announced
+GAME_EXPIRY = 12 # hours after a game's invite that it's forgotten about
+PARAMETER_SWEEP_STEP = 5 # e.g. "k=10..40" compares k=10, 15, ... 40
+PARAMETER_SWEEP_MAX = 10 # values in a single sweep
+HISTORY_STORAGE = getattr(config, "ps4_history_storage", "file") # or "sqlite"
 
 def default_max_players(channel):
     if channel in channel_max_players:
@@ -1,19 +1,23 @@
+from collections import deque
 from functools import reduce
+from itertools import chain
 initial_ranking = 1500
 default_k_factor = 20
 scrub_modifier = 1.1
 minimum_games_played = 10
+max_history_length = 20 # longest get_history() supported, unless a player keeps full history
 
 class Result:
     win = 1
     loss = 0
 
 class Player:
-    def __init__(self, id, ranking=initial_ranking):
+    def __init__(self, id, ranking=initial_ranking, full_history=False):
         self.id = id
         self.ranking = ranking
         self.games_played = 0
-        self.historical_ranking = []
+        # one more than the history shown, to compare the first shown game against
+        self.historical_ranking = deque(maxlen=None if full_history else max_history_length + 1)
 
     def get_name(self):
         if self.games_played > minimum_games_played:
@@ -28,11 +32,13 @@ class Player:
     def get_history(self, history_length):
         if history_length <= 0:
             return ""
+        if self.historical_ranking.maxlen is not None and history_length >= self.historical_ranking.maxlen:
+            raise ValueError("only the last {} games are kept".format(self.historical_ranking.maxlen - 1))
 
         results = []
         previous_rank = None
 
-        relevant_history = self.historical_ranking[-(history_length + 1):]
+        relevant_history = list(self.historical_ranking)[-(history_length + 1):]
         for rank in relevant_history:
             if previous_rank is None:
                 short_history = len(relevant_history) != history_length + 1
@@ -48,6 +54,8 @@ class Player:
 
 
 class HistoricalRank:
+    __slots__ = ("rank", "team", "delta", "scrub_modifier")
+
     def __init__(self, rank, team, delta, scrub_modifier):
         self.rank = rank
         self.team = team
@@ -61,7 +69,7 @@ class Game:
         self.scrubs = scrubs
 
     def player_ids(self):
-        return reduce(list.__add__, self.teams)
+        return list(chain.from_iterable(self.teams))
 
 def expected_score(ranking, other_ranking):
     diff = 10 ** ((other_ranking - ranking) / float(400))
@@ -83,43 +91,44 @@ def ranking_delta(ranking, other_ranking, result, k_factor):
 
     return initial_delta
 
-def combined_ranking_for_team(team, players):
-    if len(team) == 0:
-        return 0
-    return sum([player_from_id(players, player_id).ranking for player_id in team]) / len(team)
-
-def other_team_ranking(teams, players):
-    merged_teams = reduce(list.__add__, teams)
-    return combined_ranking_for_team(merged_teams, players)
+def team_ranking_sum(team, players):
+    return sum(player_from_id(players, player_id).ranking for player_id in team)
 
 def ranking_delta_for_game(game, players, k_factor):
     teams = game.teams
     winning_team_index = game.winning_team_index
 
-    team_rankings = [combined_ranking_for_team(team, players) for team in teams]
+    # each team's rating sum, once, to average over whichever teams are needed
+    team_sums = [team_ranking_sum(team, players) for team in teams]
+    team_sizes = [len(team) for team in teams]
 
-    players_delta = {}
-    for index, team in enumerate(teams):
-        for player_id in team:
-            if index == winning_team_index:
-                team_result = Result.win
+    def average(total, size):
+        return total / size if size else 0
 
-                other_teams = teams[:winning_team_index] + teams[winning_team_index+1 :]
+    winning_rank = average(team_sums[winning_team_index], team_sizes[winning_team_index])
+    others_rank = average(
+            sum(team_sums) - team_sums[winning_team_index],
+            sum(team_sizes) - team_sizes[winning_team_index])
 
-                other_team_rank = other_team_ranking(other_teams, players)
-            else:
-                team_result = Result.loss
-                other_team_rank = team_rankings[winning_team_index]
+    players_delta = {}
+    for index, team in enumerate(teams):
+        if index == winning_team_index:
+            team_result = Result.win
+            other_team_rank = others_rank
+        else:
+            team_result = Result.loss
+            other_team_rank = winning_rank
 
+        for player_id in team:
             player_ranking = player_from_id(players, player_id).ranking
             rank_delta = ranking_delta(player_ranking, other_team_rank, team_result, k_factor)
             players_delta[player_id] = rank_delta
 
     return players_delta
 
-def calculate_scrub_modifier(player, game):
+def calculate_scrub_modifier(player, game, modifier = scrub_modifier):
     if player.id in game.scrubs:
-        return scrub_modifier ** game.scrubs[player.id]
+        return modifier ** game.scrubs[player.id]
     return 1
 
 def player_from_id(players, player_id):
@@ -127,36 +136,33 @@ def player_from_id(players, player_id):
         return players[player_id]
     return Player(player_id)
 
-def player_in_winning_team(player, game):
-    team_index = -1
-    for index, team in enumerate(game.teams):
-        if player.id in team:
-            team_index = index
-            break
+def apply_game(players, game, k_factor, modifier = scrub_modifier, full_history = False):
+    for player_id in game.player_ids():
+        if player_id not in players:
+            players[player_id] = Player(player_id, full_history=full_history)
 
-    return team_index == game.winning_team_index
+    individual_ranking_delta = ranking_delta_for_game(game, players, k_factor)
 
-def calculate_rankings(games, k_factor):
+    for index, team in enumerate(game.teams):
+        won = index == game.winning_team_index
+        for player in [players[player_id] for player_id in team]:
+            player.games_played += 1
+
+            scrub_modifier = 1
+            if won:
+                scrub_modifier = calculate_scrub_modifier(player, game, modifier)
+
+            player.ranking += round(individual_ranking_delta[player.id] * scrub_modifier)
+            player.historical_ranking.append(HistoricalRank(
+                player.ranking, team, individual_ranking_delta, scrub_modifier))
+
+def calculate_rankings(games, k_factor, modifier = scrub_modifier, full_history = False):
+    """
+    full_history keeps every game's HistoricalRank, rather than just enough for get_history()
+    """
     players = {}
 
     for game in games:
-        game_players = game.player_ids()
-        for player_id in game_players:
-            if player_id not in players:
-                players[player_id] = player_from_id(players, player_id)
-
-        individual_ranking_delta = ranking_delta_for_game(game, players, k_factor)
-
-        for team in game.teams:
-            for player in [player_from_id(players, player_id) for player_id in team]:
-                player.games_played += 1
-
-                scrub_modifier = 1
-                if player_in_winning_team(player, game):
-                    scrub_modifier = calculate_scrub_modifier(player, game)
-
-                player.ranking += round(individual_ranking_delta[player.id] * scrub_modifier)
-                player.historical_ranking.append(HistoricalRank(
-                    player.ranking, team, individual_ranking_delta, scrub_modifier))
+        apply_game(players, game, k_factor, modifier, full_history)
 
     return players
@@ -1,9 +1,54 @@
 import unittest
 import elo
 
+import random
+import sys
+import time
+from functools import reduce
+
 def game_rankdelta(game, players):
     return elo.ranking_delta_for_game(game, players, None)
 
+def legacy_ranking_delta_for_game(game, players, k_factor):
+    # the original: merges and re-averages the other teams for every winner
+    def combined_ranking_for_team(team):
+        if len(team) == 0:
+            return 0
+        return sum([elo.player_from_id(players, p).ranking for p in team]) / len(team)
+
+    teams = game.teams
+    winning_team_index = game.winning_team_index
+    team_rankings = [combined_ranking_for_team(team) for team in teams]
+
+    players_delta = {}
+    for index, team in enumerate(teams):
+        for player_id in team:
+            if index == winning_team_index:
+                team_result = elo.Result.win
+                other_teams = teams[:winning_team_index] + teams[winning_team_index+1 :]
+                other_team_rank = combined_ranking_for_team(reduce(list.__add__, other_teams))
+            else:
+                team_result = elo.Result.loss
+                other_team_rank = team_rankings[winning_team_index]
+
+            player_ranking = elo.player_from_id(players, player_id).ranking
+            players_delta[player_id] = elo.ranking_delta(player_ranking, other_team_rank, team_result, k_factor)
+
+    return players_delta
+
+def recorded_history(count):
+    rand = random.Random(42)
+    ids = ["p{}".format(i) for i in range(16)]
+
+    games = []
+    for _ in range(count):
+        picked = rand.sample(ids, rand.choice([2, 4, 8, 12, 16]))
+        team_count = rand.choice([2, 2, 2, 4])
+        teams = [picked[i::team_count] for i in range(team_count)]
+        scrubs = { p: 1 for p in picked if rand.random() < 0.1 }
+        games.append(elo.Game(teams, rand.randrange(team_count), scrubs))
+    return games
+
 class TestPS4Elo(unittest.TestCase):
     def test_expected_score(self):
         def calc_score(ranking, other_ranking):
@@ -148,5 +193,40 @@ class TestPS4Elo(unittest.TestCase):
         self.assertEqual(result2[3].ranking, 1528)
         self.assertEqual(result2[4].ranking, 1528)
 
+    def test_history_bounded_unless_full(self):
+        games = recorded_history(500)
+        bounded = elo.calculate_rankings(games, None)
+        full = elo.calculate_rankings(games, None, full_history=True)
+
+        for id, player in bounded.items():
+            self.assertEqual(len(player.historical_ranking), elo.max_history_length + 1)
+            self.assertEqual(len(full[id].historical_ranking), player.games_played)
+            for length in [1, 5, elo.max_history_length]:
+                self.assertEqual(player.get_history(length), full[id].get_history(length))
+            with self.assertRaises(ValueError):
+                player.get_history(elo.max_history_length + 1)
+
+    def test_ranking_delta_for_game_matches_legacy(self):
+        games = recorded_history(2000)
+
+        players = {}
+        for game in games:
+            self.assertEqual(
+                    elo.ranking_delta_for_game(game, players, None),
+                    legacy_ranking_delta_for_game(game, players, None))
+            elo.apply_game(players, game, None)
+
+        def bench(fn):
+            players = elo.calculate_rankings(games, None)
+            start = time.perf_counter()
+            for game in games:
+                fn(game, players, None)
+            return time.perf_counter() - start
+
+        legacy = bench(legacy_ranking_delta_for_game)
+        current = bench(elo.ranking_delta_for_game)
+        print("elo deltas for {} games: {:.1f}ms, legacy {:.1f}ms".format(
+            len(games), current * 1e3, legacy * 1e3), file=sys.stderr)
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,6 @@
 import datetime
 from bots.ps4.formatting import format_user, when_str, pretty_players
-from bots.ps4.cfg import default_max_players, PLAY_TIME
+from bots.ps4.cfg import default_max_players, PLAY_TIME, GAME_KICKOFF_NOTICE, GAME_EXPIRY
 from bots.ps4.historicgame import PS4HistoricGame
 from bots.ps4.parsing import pretty_mode
 from bots.ps4.gamecategory import gametype_from_channel
@@ -42,11 +42,29 @@ class Game:
         self.play_time = play_time
         self.mode = mode
         self.type = gametype_from_channel(channel)
+        self.player_listener = None # fn(game, player, removed), told of each roster change
 
     def endtime(self):
         duration = datetime.timedelta(minutes = self.play_time)
         return self.when + duration
 
+    def next_transition(self):
+        """
+        When the game should move on from its current state, or None once it's dead
+        """
+        if self.state == GameStates.scheduled:
+            return self.when - datetime.timedelta(minutes = GAME_KICKOFF_NOTICE)
+        if self.state == GameStates.active:
+            return self.endtime()
+        if self.state == GameStates.finished:
+            posted = datetime.datetime.fromtimestamp(float(self.message.timestamp))
+            return posted + datetime.timedelta(hours = GAME_EXPIRY)
+        return None
+
+    def advance_state(self):
+        if self.state != GameStates.dead:
+            self.state += 1
+
     def contains(self, when, start_overlap = True):
         game_start = self.when
         game_end = self.endtime()
@@ -60,12 +78,16 @@ class Game:
         if len(self.players) >= self.max_player_count:
             raise GameFull()
         self.players.append(p)
+        if self.player_listener:
+            self.player_listener(self, p, False)
 
     def remove_player(self, p):
         if p not in self.players:
             return False
 
         self.players.remove(p)
+        if self.player_listener:
+            self.player_listener(self, p, True)
         return True
 
     def update_when(self, new_when, new_banter):
@@ -0,0 +1,82 @@
+import bisect
+import datetime
+import itertools
+
+class GameIndex:
+    """
+    Scheduled games, kept sorted by start time for each game type, so the
+    overlap / occurrence lookups only look at games starting nearby rather
+    than every game
+
+    A game's end is its start plus its play_time, so a game that's in
+    progress at some time must have started no more than the longest
+    play_time of its type before it.
+    """
+    def __init__(self):
+        self.starts = {} # gametype => sorted [(when, seq), ...]
+        self.games = {} # seq => game
+        self.entries = {} # game => (when, seq), as indexed
+        self.longest = {} # gametype => longest play_time (minutes) seen
+        self.seq = itertools.count()
+
+    def add(self, game):
+        entry = (game.when, next(self.seq))
+        bisect.insort(self.starts.setdefault(game.type, []), entry)
+        self.games[entry[1]] = game
+        self.entries[game] = entry
+        # not shrunk on removal - a longer window only means more candidates
+        self.longest[game.type] = max(self.longest.get(game.type, 0), game.play_time)
+
+    def remove(self, game):
+        entry = self.entries.pop(game, None)
+        if entry is None:
+            return
+        starts = self.starts[game.type]
+        del starts[bisect.bisect_left(starts, entry)]
+        del self.games[entry[1]]
+
+    def move(self, game):
+        """
+        Re-indexes the game after its when has changed
+        """
+        self.remove(game)
+        self.add(game)
+
+    def starting_between(self, gametype, start, end, include_end = False):
+        """
+        Games of gametype with start <= when < end (or <= end), earliest first
+        """
+        starts = self.starts.get(gametype, [])
+        # (x,) sorts before any (x, seq)
+        for i in range(bisect.bisect_left(starts, (start,)), len(starts)):
+            when, seq = starts[i]
+            if end < when or (when == end and not include_end):
+                break
+            yield self.games[seq]
+
+    def in_progress_around(self, gametype, start, end):
+        """
+        Games of gametype which might be in progress at some point in [start, end]
+        """
+        longest = datetime.timedelta(minutes = self.longest.get(gametype, 0))
+        return self.starting_between(gametype, start - longest, end, include_end = True)
+
+    def occurring_at(self, when, gametype):
+        for game in self.in_progress_around(gametype, when, when):
+            if game.contains(when):
+                return game
+        return None
+
+    def overlapping(self, when, play_time, gametype, ignoring = None):
+        when_end = when + datetime.timedelta(minutes = play_time)
+        for game in self.in_progress_around(gametype, when, when_end):
+            if game == ignoring:
+                continue
+            if game.contains(when) or game.contains(when_end, start_overlap = False):
+                return game
+        return None
+
+    def straight_after(self, previous, threshold):
+        endtime = previous.endtime()
+        threshold_delta = datetime.timedelta(minutes = threshold)
+        return next(self.starting_between(previous.type, endtime, endtime + threshold_delta), None)
@@ -0,0 +1,72 @@
+import unittest
+
+import sys
+
+from os import path
+fcwd = path.dirname(__file__)
+sys.path.insert(0, path.abspath("{}/../../".format(fcwd)))
+
+import datetime
+import random
+from bots.ps4.game import Game
+from bots.ps4.gameindex import GameIndex
+from msg.slackpostedmessage import SlackPostedMessage
+
+def scan_occurring_at(games, when, gametype):
+    return [g for g in games if g.type == gametype and g.contains(when)]
+
+def scan_overlapping(games, when, play_time, gametype, ignoring):
+    when_end = when + datetime.timedelta(minutes = play_time)
+    return [g for g in games
+            if g != ignoring and g.type == gametype
+            and (g.contains(when) or g.contains(when_end, start_overlap = False))]
+
+def scan_straight_after(games, previous, threshold):
+    endtime = previous.endtime()
+    return [g for g in games
+            if g.type == previous.type
+            and endtime <= g.when < endtime + datetime.timedelta(minutes = threshold)]
+
+class TestGameIndex(unittest.TestCase):
+    def test_index_matches_linear_scan(self):
+        rand = random.Random(1)
+        base = datetime.datetime(2020, 1, 1, 9, 0)
+        def at(minutes):
+            return base + datetime.timedelta(minutes = minutes)
+
+        index = GameIndex()
+        games = []
+        for i in range(300):
+            channel = rand.choice(["games", "fifa", "foosball"])
+            game = Game(at(rand.randrange(0, 600, 5)), "desc", channel, "p1",
+                    SlackPostedMessage(channel, str(i), None), 4, rand.choice([5, 15, 30, 90]), None, False)
+            games.append(game)
+            index.add(game)
+
+        for game in rand.sample(games, 100):
+            games.remove(game)
+            index.remove(game)
+        for game in rand.sample(games, 50):
+            game.when = at(rand.randrange(0, 600, 5))
+            index.move(game)
+
+        gametypes = set(g.type for g in games)
+        for _ in range(500):
+            when = at(rand.randrange(-60, 660, 5))
+            gametype = rand.choice(list(gametypes))
+            ignoring = rand.choice(games)
+
+            found = index.occurring_at(when, gametype)
+            matches = scan_occurring_at(games, when, gametype)
+            self.assertTrue(found in matches if matches else found is None)
+
+            found = index.overlapping(when, 30, gametype, ignoring)
+            matches = scan_overlapping(games, when, 30, gametype, ignoring)
+            self.assertTrue(found in matches if matches else found is None)
+
+            found = index.straight_after(ignoring, 15)
+            matches = scan_straight_after(games, ignoring, 15)
+            self.assertTrue(found in matches if matches else found is None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,35 @@
-from .historystats import Stats
+from .historystats import Stats, intern_str
 
 class PS4HistoricGame:
+    # tens of thousands of these are kept in memory, so keep them small:
+    # no per-instance __dict__, and user/channel/mode strings shared between games
+    __slots__ = ("message_timestamp", "_players", "channel", "mode", "stats")
+
     def __init__(self, message_timestamp, players, channel, mode):
         self.message_timestamp = message_timestamp
         self.players = players
-        self.channel = channel
-        self.mode = mode
+        self.channel = intern_str(channel)
+        self.mode = intern_str(mode)
         self.stats = Stats()
+
+    @classmethod
+    def restore(cls, message_timestamp, players, channel, mode, stats):
+        """
+        A game from parts that are already interned, e.g. read from a snapshot's
+        string table, skipping the per-string work of __init__
+        """
+        game = cls.__new__(cls)
+        game.message_timestamp = message_timestamp
+        game._players = players
+        game.channel = channel
+        game.mode = mode
+        game.stats = stats
+        return game
+
+    @property
+    def players(self):
+        return self._players
+
+    @players.setter
+    def players(self, players):
+        self._players = [intern_str(p) for p in players]
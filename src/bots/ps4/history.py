@@ -1,16 +1,20 @@
 import sys
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import datetime
-
-from functional import find
+import itertools
 
 from .historicgame import PS4HistoricGame
-from .elo import Game, calculate_rankings
+from .snapshot import serialise_timestamp, deserialise_timestamp
+from .storage import open_storage
+from .elo import Game
+from .incrementalelo import IncrementalElo
+from .batchelo import calculate_rankings_batch
 from .gamecategory import limit_game_to_single_win, Stats
+from .cfg import HISTORY_STORAGE
 
-SAVE_FILE = "ps4-stats.txt"
 DEFAULT_GAME_HISTORY = 5
-DATE_FMT = "%H:%M"
+CACHED_GAMES = 1000 # recently used games held, when the storage keeps the rest
+CACHED_ELO_RATINGS = 16 # (channel, year, k_factor)s kept up to date, most recently asked for
 
 class Keys:
     game_wins = "Game Wins"
@@ -19,84 +23,231 @@ class Keys:
     elorank = "Ranking"
     history = "History"
 
-def should_skip_game_year(game, year, nextyear):
-    if not year:
-        return False
+def game_year(game):
+    """
+    The year the game was played, or None if its timestamp doesn't say
+    """
+    timestamp = game.message_timestamp
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp.year
+    try:
+        seconds = float(timestamp)
+    except (TypeError, ValueError):
+        return None
+    return datetime.datetime.fromtimestamp(seconds).year
 
-    gametime = datetime.datetime.fromtimestamp(float(game.message_timestamp))
-    involved = year <= gametime < nextyear
-    return not involved
+class PS4History:
+    """
+    Every game played, and the stats recorded for it
 
-def calc_nextyear(year):
-    return year.replace(year = year.year + 1) if year else None
+    Games are kept in a storage.Storage (by default, a snapshot file plus a
+    journal of changes since), which every change is recorded to.
 
-class PS4History:
-    def __init__(self, negative_stats=set(), load=True):
+    If the storage keeps_games (i.e. sqlite), it's asked for games as they're
+    needed, and only the CACHED_GAMES most recently used are held here.
+    Otherwise every game is in self.games.
+    """
+    def __init__(self, negative_stats=set(), load=True, storage=None):
         self.games = []
+        self.cached_games = OrderedDict() # message timestamp => game, least recently used first
+        self.games_by_timestamp = dict() # message timestamp => game
+        self.games_by_channel = defaultdict(list) # channel => [game, ...], in self.games order
+        self.games_by_channel_year = defaultdict(list) # (channel, year) => [game, ...], likewise
+        self.elo_ratings = OrderedDict() # (channel, year, k_factor) => IncrementalElo, least recently used first
+        # { mode: { user: { [stat]: int ... }, ... } }, per channel and per (channel, year)
+        self.channel_aggregates = defaultdict(dict)
+        self.year_aggregates = defaultdict(dict)
+        self.champion_cache = dict()
         self.negative_stats = negative_stats
+        self.storage = None # only once loaded - until then we're in-memory only
         if load:
-            self.load()
+            self.load(storage)
 
     def save(self):
+        if self.storage:
+            self.storage.save(self.games)
+
+    def flush(self):
+        """
+        Makes sure recent changes are on disk
+        """
+        if self.storage:
+            self.storage.flush(self.games)
+
+    def load(self, storage = None):
+        if self.storage:
+            self.storage.close()
+        self.storage = storage or open_storage(HISTORY_STORAGE)
+        games, records = self.storage.load()
+
+        self.games = []
+        self.cached_games = OrderedDict()
+        self.games_by_timestamp = dict()
+        self.games_by_channel = defaultdict(list)
+        self.games_by_channel_year = defaultdict(list)
+        self.elo_ratings = OrderedDict()
+        self.channel_aggregates = defaultdict(dict)
+        self.year_aggregates = defaultdict(dict)
+        self.champion_cache = dict()
+        for game in games:
+            self._add_game(game)
+
+        for record in records:
+            self.replay(record)
+
+    def replay(self, record):
+        kind, gametime = record[0], deserialise_timestamp(record[1])
         try:
-            with open(SAVE_FILE, "w") as f: # open as "w" since we rewrite the whole thing
-                for g in self.games:
-                    print("game {} {} {} {}".format(
-                        g.message_timestamp.strftime(DATE_FMT),
-                        g.channel,
-                        ",".join(g.players),
-                        g.mode or "normal"), file=f)
-
-                    for stat in g.stats:
-                        print("  stat {} {} {}".format(stat.stat, stat.user, stat.voter), file=f)
-        except IOError:
-            print("exception saving state: {}".format(e), file=sys.stderr)
-
-    def load(self):
-        games = []
-        try:
-            with open(SAVE_FILE, "r") as f:
-                current_game = None
-                for line in iter(f.readline, ""):
-                    line = line.rstrip("\n").lstrip(" ")
-                    tokens = line.split(" ")
-
-                    if tokens[0] == "game":
-                        message_timestamp = datetime.datetime.strptime(tokens[1], DATE_FMT)
-                        channel = tokens[2]
-                        players = [t for t in tokens[3].split(",") if len(t)]
-                        mode = None if tokens[4] == "normal" else tokens[4]
-                        current_game = PS4HistoricGame(message_timestamp, players, channel, mode)
-                        games.append(current_game)
-                    elif tokens[0] == "stat":
-                        if not current_game:
-                            print("found stat \"{}\" without game".format(tokens[1]), file=sys.stderr)
-                            continue
-                        stat, user, voter = tokens[1:]
-                        current_game.stats.add(stat, user, voter)
-                    else:
-                        print("unknown {} line \"{}\"".format(SAVE_FILE, line), file=sys.stderr)
-        except IOError:
-            pass
-        self.games = games
+            if kind == "add-game":
+                channel, players, mode = record[2:]
+                players = [p for p in players.split(",") if len(p)]
+                self._add_game(PS4HistoricGame(gametime, players, channel, None if mode == "normal" else mode))
+            elif kind == "cancel-game":
+                self._cancel_game(gametime)
+            elif kind == "add-stat" or kind == "remove-stat":
+                stat, user, voter = record[2:]
+                self._register_stat(gametime, user, voter, kind == "remove-stat", stat)
+            elif kind == "players":
+                self._update_players(gametime, [p for p in record[2].split(",") if len(p)])
+            elif kind == "add-player":
+                self._add_player(gametime, record[2])
+            elif kind == "remove-player":
+                self._remove_player(gametime, record[2])
+            else:
+                print("unknown history record \"{}\"".format(" ".join(record)), file=sys.stderr)
+        except ValueError:
+            print("invalid history record \"{}\"".format(" ".join(record)), file=sys.stderr)
+
+    def record(self, *tokens):
+        if self.storage:
+            self.storage.record(*tokens)
 
     def add_game(self, game):
-        if find(lambda g: g.message_timestamp == game.message.timestamp, self.games):
+        historic = game.to_historic()
+        if not self._add_game(historic):
             return
-        self.games.append(game.to_historic())
-        self.save()
+        self.record(
+                "add-game",
+                serialise_timestamp(historic.message_timestamp),
+                historic.channel,
+                ",".join(historic.players),
+                historic.mode or "normal")
+
+    def _add_game(self, historic):
+        if self.find_game(historic.message_timestamp):
+            return False
+        if self.storage and self.storage.keeps_games:
+            self.cache_game(historic)
+        else:
+            self.games.append(historic)
+            self.games_by_timestamp[historic.message_timestamp] = historic
+            self.games_by_channel[historic.channel].append(historic)
+            self.games_by_channel_year[(historic.channel, game_year(historic))].append(historic)
+        self.aggregate(historic)
+        return True
 
     def cancel_game(self, game):
-        found = find(lambda g: g.message_timestamp == game.message.timestamp, self.games)
+        if self._cancel_game(game.message.timestamp):
+            self.record("cancel-game", serialise_timestamp(game.message.timestamp))
+
+    def _cancel_game(self, gametime):
+        found = self.find_game(gametime)
         if not found:
-            return
-        self.games.remove(found)
-        self.save()
+            return False
+        if self.storage and self.storage.keeps_games:
+            del self.cached_games[found.message_timestamp]
+        else:
+            self.games.remove(found)
+            del self.games_by_timestamp[gametime]
+            self.games_by_channel[found.channel].remove(found)
+            self.games_by_channel_year[(found.channel, game_year(found))].remove(found)
+        self.invalidate_elo(found, removed = True)
+        self.aggregate(found, -1)
+        return True
 
     def find_game(self, gametime):
-        return find(lambda g: g.message_timestamp == gametime, self.games)
+        if not (self.storage and self.storage.keeps_games):
+            return self.games_by_timestamp.get(gametime)
+
+        game = self.cached_games.get(gametime)
+        if game is None:
+            game = self.storage.find_game(serialise_timestamp(gametime))
+            if game is None:
+                return None
+        self.cache_game(game)
+        return game
+
+    def cache_game(self, game):
+        self.cached_games[game.message_timestamp] = game
+        self.cached_games.move_to_end(game.message_timestamp)
+        while len(self.cached_games) > CACHED_GAMES:
+            self.cached_games.popitem(last = False)
+
+    def games_in_channel(self, channel):
+        """
+        Games in the channel, or every game if channel is None
+        """
+        if self.storage and self.storage.keeps_games:
+            return list(self.storage.games(channel))
+        if channel:
+            return self.games_by_channel.get(channel, [])
+        return self.games
+
+    def games_from(self, channel, year, start = 0):
+        """
+        The channel's games (in year, if given) in the order they were added,
+        from the start'th on
+        """
+        if self.storage and self.storage.keeps_games:
+            return self.storage.games(channel, year.year if year else None, start)
+
+        if year:
+            games = self.games_by_channel_year.get((channel, year.year), [])
+        else:
+            games = self.games_by_channel.get(channel, [])
+        return itertools.islice(games, start, None)
+
+    def add_player(self, gametime, user):
+        if self._add_player(gametime, user):
+            self.record("add-player", serialise_timestamp(gametime), user)
+
+    def _add_player(self, gametime, user):
+        historic_game = self.find_game(gametime)
+        if historic_game is None or user in historic_game.players:
+            return False
+        return self._update_players(gametime, historic_game.players + [user])
+
+    def remove_player(self, gametime, user):
+        if self._remove_player(gametime, user):
+            self.record("remove-player", serialise_timestamp(gametime), user)
+
+    def _remove_player(self, gametime, user):
+        historic_game = self.find_game(gametime)
+        if historic_game is None or user not in historic_game.players:
+            return False
+        return self._update_players(gametime, [p for p in historic_game.players if p != user])
+
+    def _update_players(self, gametime, players):
+        historic_game = self.find_game(gametime)
+        if historic_game is None or historic_game.players == players:
+            return False
+        self.aggregate(historic_game, -1)
+        historic_game.players = players
+        self.aggregate(historic_game)
+        self.invalidate_elo(historic_game)
+        return True
 
     def register_stat(self, gametime, user, voter, removed, stat):
+        if not self._register_stat(gametime, user, voter, removed, stat):
+            return False
+
+        self.record(
+                "remove-stat" if removed else "add-stat",
+                serialise_timestamp(gametime),
+                stat, user, voter)
+        return True
+
+    def _register_stat(self, gametime, user, voter, removed, stat):
         historic_game = self.find_game(gametime)
         if historic_game is None:
             return False
@@ -104,49 +255,96 @@ class PS4History:
         if voter not in historic_game.players:
             return False
 
+        self.aggregate(historic_game, -1)
         if removed:
             historic_game.stats.remove(stat, user, voter)
         else:
             historic_game.stats.add(stat, user, voter)
-
-        self.save()
+        self.aggregate(historic_game)
+        self.invalidate_elo(historic_game)
         return True
 
     def stat_is_positive(self, stat):
         return stat not in self.negative_stats
 
     def user_has_winstat_in_game(self, searchuser, game):
-        for stat_and_user in game.stats:
-            if stat_and_user.user == searchuser and self.stat_is_positive(stat_and_user.stat):
-                return True
-        return False
+        return any(s.user == searchuser and self.stat_is_positive(s.stat) for s in game.stats)
 
-    def raw_stats(self, channel, year = None):
-        stats = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    def game_contribution(self, game):
+        """
+        What the game adds to its mode's stats: { user: { [stat]: int ... }, ... }
+        """
+        counts = defaultdict(lambda: defaultdict(int))
 
-        nextyear = calc_nextyear(year)
+        for user in game.players:
+            counts[user][Keys.played] += 1
+            if self.user_has_winstat_in_game(user, game):
+                counts[user][Keys.game_wins] += 1
 
-        for game in self.games:
-            if channel and game.channel != channel:
-                continue
-            if should_skip_game_year(game, year, nextyear):
-                continue
+        game_winners = set()
+        for stat_and_user in game.stats:
+            stat, user = stat_and_user.stat, stat_and_user.user
+            if limit_game_to_single_win(game.channel) and self.stat_is_positive(stat):
+                if user in game_winners:
+                    continue
+                game_winners.add(user)
+
+            counts[user][stat] += 1
 
-            game_winners = set()
-            for stat_and_user in game.stats:
-                stat, user = stat_and_user.stat, stat_and_user.user
-                if limit_game_to_single_win(channel) and self.stat_is_positive(stat):
-                    if user in game_winners:
-                        continue
-                    game_winners.add(user)
+        return counts
+
+    def aggregate(self, game, sign = 1):
+        """
+        Adds (or with sign = -1, removes) the game's stats to its channel's totals
+        """
+        year = game_year(game)
+        self.invalidate_champions(game.channel, year)
+        if self.storage and self.storage.counts_stats:
+            return # counted by the storage instead
+
+        contribution = self.game_contribution(game)
+        tables = [
+            self.channel_aggregates[game.channel],
+            self.year_aggregates[(game.channel, year)],
+        ]
+
+        for table in tables:
+            modestats = table.setdefault(game.mode, dict())
+            for user, counts in contribution.items():
+                userstats = modestats.setdefault(user, dict())
+                for stat, count in counts.items():
+                    total = userstats.get(stat, 0) + sign * count
+                    if total:
+                        userstats[stat] = total
+                    else:
+                        userstats.pop(stat, None)
+                if len(userstats) == 0:
+                    del modestats[user]
+            if len(modestats) == 0:
+                del table[game.mode]
+
+    def aggregate_tables(self, channel, year):
+        if self.storage and self.storage.counts_stats:
+            return [self.storage.stat_totals(channel, year,
+                self.stat_is_positive, limit_game_to_single_win,
+                played_key = Keys.played, wins_key = Keys.game_wins)]
+        if channel and year:
+            return [self.year_aggregates.get((channel, year.year), {})]
+        if channel:
+            return [self.channel_aggregates.get(channel, {})]
+        if year:
+            return [t for (_, y), t in self.year_aggregates.items() if y == year.year]
+        return list(self.channel_aggregates.values())
 
-                stats[game.mode][user][stat] += 1
-                # don't count total or played here, may be multiple stats per game
+    def raw_stats(self, channel, year = None):
+        stats = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
 
-            for user in game.players:
-                stats[game.mode][user][Keys.played] += 1
-                if self.user_has_winstat_in_game(user, game):
-                    stats[game.mode][user][Keys.game_wins] += 1
+        # copy, since callers add to what we return
+        for table in self.aggregate_tables(channel, year):
+            for mode, modestats in table.items():
+                for user, userstats in modestats.items():
+                    for stat, count in userstats.items():
+                        stats[mode][user][stat] += count
 
         # calculate win %ages
         for mode in stats:
@@ -161,45 +359,51 @@ class PS4History:
 
         return stats # { mode: { user: { [stat]: int ... }, ... } }
 
-    def raw_elo(self, channel, year = None, k_factor = None):
-        nextyear = calc_nextyear(year)
-
-        def game_is_this_channel(game):
-            return game.channel == channel
-
-        def game_in_this_year(game):
-            return not should_skip_game_year(game, year, nextyear)
+    def convert_to_elo_game(self, game):
+        """
+        The game's teams (winners and losers) as an elo.Game, or None if it can't be ranked
+        """
+        scrub = defaultdict(int)
+        winners = []
+        for stat in game.stats:
+            if self.stat_is_positive(stat.stat):
+                winners.append(stat.user)
+            else:
+                scrub[stat.user] += 1
 
-        def convert_to_elo_game(game):
-            scrub = defaultdict(int)
-            winners = []
-            for stat in game.stats:
-                if self.stat_is_positive(stat.stat):
-                    winners.append(stat.user)
-                else:
-                    scrub[stat.user] += 1
+        losers = list(set(game.players) - set(winners))
+        teams = [winners, losers]
+        winning_team_index = 0
 
-            losers = list(set(game.players) - set(winners))
-            teams = [winners, losers]
-            winning_team_index = 0
+        for team in teams:
+            if len(team) == 0:
+                return None
 
-            return Game(teams, winning_team_index, scrub)
+        return Game(teams, winning_team_index, scrub)
 
-        def game_can_elo(game):
-            for team in game.teams:
-                if len(team) == 0:
-                    return False
-            return True
+    def raw_elo(self, channel, year = None, k_factor = None):
+        key = (channel, year.year if year else None, k_factor)
+        ratings = self.elo_ratings.get(key)
+        if ratings is None:
+            ratings = self.elo_ratings[key] = IncrementalElo(k_factor, self.convert_to_elo_game)
+            while len(self.elo_ratings) > CACHED_ELO_RATINGS:
+                self.elo_ratings.popitem(last = False)
+        self.elo_ratings.move_to_end(key)
 
-        elo_games = self.games
-        elo_games = filter(game_is_this_channel, elo_games)
-        elo_games = filter(game_in_this_year, elo_games)
-        elo_games = map(convert_to_elo_game, elo_games)
-        elo_games = filter(game_can_elo, elo_games)
+        return ratings.update(lambda start: self.games_from(channel, year, start))
 
-        rankings = calculate_rankings(elo_games, k_factor)
+    def elo_sweep(self, channel, year, k_factors):
+        """
+        Elo rankings for each of the k_factors, in one pass over the games
+        """
+        elo_games = filter(None, map(self.convert_to_elo_game, self.games_from(channel, year)))
+        return calculate_rankings_batch(elo_games, k_factors)
 
-        return rankings
+    def invalidate_elo(self, game, removed = False):
+        year = game_year(game)
+        for (channel, ratings_year, _), ratings in self.elo_ratings.items():
+            if channel == game.channel and (ratings_year is None or ratings_year == year):
+                ratings.invalidate(game.message_timestamp, removed)
 
     def summary_stats(self, channel, year, parameters):
         rawstats = self.raw_stats(channel, year)
@@ -221,24 +425,32 @@ class PS4History:
         """
         rankmap = defaultdict(lambda: [0, 0]) # user => [wins, played]
 
-        nextyear = calc_nextyear(year)
-
-        for game in self.games:
-            if channel and game.channel != channel:
-                continue
-            if game.mode:
-                continue
-            if should_skip_game_year(game, year, nextyear):
-                continue
-            for user in game.players:
-                rankmap[user][1] += 1
-
-                if self.user_has_winstat_in_game(user, game):
-                    rankmap[user][0] += 1
+        mode = None
+        for table in self.aggregate_tables(channel, year):
+            for user, userstats in table.get(mode, {}).items():
+                played = userstats.get(Keys.played, 0)
+                if played:
+                    rankmap[user][0] += userstats.get(Keys.game_wins, 0)
+                    rankmap[user][1] += played
 
         def userratio(user):
             wins, played = rankmap[user]
             return float(wins) / played if played else 0
 
-        # [ user1, user2, ... ]
-        return sorted(rankmap, key=userratio, reverse=True)
+        # [ user1, user2, ... ], ties in name order so every storage agrees
+        return sorted(rankmap, key=lambda user: (-userratio(user), user))
+
+    def champions(self, channel, year = None, count = 3):
+        """
+        The top `count` users of user_ranking(), cached until a game in scope changes
+        """
+        key = (channel, year.year if year else None)
+        champs = self.champion_cache.get(key)
+        if champs is None:
+            champs = self.champion_cache[key] = self.user_ranking(channel, year)[:count]
+        return champs
+
+    def invalidate_champions(self, channel, year):
+        for key in list(self.champion_cache):
+            if key[0] in (channel, None) and key[1] in (year, None):
+                del self.champion_cache[key]
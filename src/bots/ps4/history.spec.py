@@ -7,7 +7,14 @@ fcwd = path.dirname(__file__)
 sys.path.insert(0, path.abspath("{}/../../".format(fcwd)))
 
 import datetime
-from bots.ps4.history import PS4History, Keys
+import os
+import tempfile
+import time
+from bots.ps4.history import PS4History, Keys, CACHED_ELO_RATINGS
+from bots.ps4.incrementalelo import MAX_CHECKPOINTS
+from bots.ps4.journal import Journal
+from bots.ps4.historystats import Stats
+from bots.ps4.elo import calculate_rankings
 from bots.ps4.game import Game
 from bots.ps4.parsing import empty_parameters
 from msg.slackpostedmessage import SlackPostedMessage
@@ -108,5 +115,234 @@ class TestPS4History(unittest.TestCase):
         # can be either way, since both players won one game
         self.assertTrue(ranking == ["p2", "p1"] or ranking == ["p1", "p2"])
 
+    def test_history_replays_journal_records(self):
+        history = PS4History()
+
+        records = [
+            ["add-game", "1500000000.000100", "channel", "p1,p2,p3", "normal"],
+            ["add-stat", "1500000000.000100", "stat.headhunter", "p1", "p1"],
+            ["add-stat", "1500000000.000100", "stat.survival", "p2", "p2"],
+            ["remove-stat", "1500000000.000100", "stat.survival", "p2", "p2"],
+            ["players", "1500000000.000100", "p1,p2"],
+            ["add-game", "1500000001.000100", "channel", "p1", "normal"],
+            ["cancel-game", "1500000001.000100"],
+        ]
+        for record in records:
+            history.replay(record)
+
+        self.assertEqual(len(history.games), 1)
+        game = history.find_game("1500000000.000100")
+        self.assertEqual(game.players, ["p1", "p2"])
+        self.assertEqual([(s.stat, s.user) for s in game.stats], [("stat.headhunter", "p1")])
+
+    def test_history_indexes_games_by_timestamp_and_channel(self):
+        history = PS4History()
+
+        when = datetime.datetime.today()
+        when2 = when + datetime.timedelta(30)
+        game = Game(when, "desc", "channel", "creator", SlackPostedMessage("channel", when, None), 4, 30, None, False)
+        game2 = Game(when2, "desc", "other", "creator", SlackPostedMessage("other", when2, None), 4, 30, None, False)
+
+        history.add_game(game)
+        history.add_game(game2)
+        history.add_game(game) # duplicate, ignored
+
+        self.assertEqual(history.find_game(when).channel, "channel")
+        self.assertEqual(len(history.games_in_channel("channel")), 1)
+        self.assertEqual(len(history.games_in_channel(None)), 2)
+
+        history.cancel_game(game)
+        self.assertIsNone(history.find_game(when))
+        self.assertEqual(history.games_in_channel("channel"), [])
+        self.assertEqual(history.find_game(when2).channel, "other")
+
+    def test_history_incremental_elo_matches_full_recalculation(self):
+        history = PS4History(set(["stat.scrub"]))
+        players = ["p1", "p2", "p3", "p4", "p5"]
+
+        def gametime(i):
+            return "{}.000100".format(1500000000 + i * 3600)
+
+        for i in range(120):
+            game_players = [players[(i + j) % len(players)] for j in range(3)]
+            history.replay(["add-game", gametime(i), "channel", ",".join(game_players), "normal"])
+            history.replay(["add-stat", gametime(i), "stat.win", game_players[i % 3], game_players[0]])
+            if i % 7 == 0:
+                history.replay(["add-stat", gametime(i), "stat.scrub", game_players[1], game_players[0]])
+
+        def assertMatchesFull():
+            games = history.games_in_channel("channel")
+            expected = calculate_rankings(filter(None, map(history.convert_to_elo_game, games)), None)
+            got = history.raw_elo("channel")
+            self.assertEqual(
+                    { p: (r.ranking, r.games_played, r.get_history(10)) for p, r in got.items() },
+                    { p: (r.ranking, r.games_played, r.get_history(10)) for p, r in expected.items() })
+
+        assertMatchesFull()
+
+        # edit an early game, after the first checkpoint
+        history.register_stat(gametime(60), "p5", "p2", False, "stat.win")
+        assertMatchesFull()
+
+        history.replay(["cancel-game", gametime(10)])
+        assertMatchesFull()
+
+        history.replay(["add-game", gametime(500), "channel", "p1,p2", "normal"])
+        history.register_stat(gametime(500), "p2", "p1", False, "stat.win")
+        assertMatchesFull()
+
+    def test_history_incremental_elo_beats_full_recalculation(self):
+        history = PS4History()
+        players = ["p{}".format(i) for i in range(12)]
+
+        def gametime(i):
+            return "{}.000100".format(1500000000 + i * 3600)
+
+        count = 10000
+        for i in range(count):
+            game_players = [players[(i * 7 + j * 5) % len(players)] for j in range(4)]
+            history.replay(["add-game", gametime(i), "channel", ",".join(game_players), "normal"])
+            history.replay(["add-stat", gametime(i), "stat.win", game_players[i % 4], game_players[0]])
+
+        def full():
+            games = history.games_in_channel("channel")
+            return calculate_rankings(filter(None, map(history.convert_to_elo_game, games)), None)
+
+        def timed(fn):
+            start = time.perf_counter()
+            result = fn()
+            return result, time.perf_counter() - start
+
+        _, first = timed(lambda: history.raw_elo("channel"))
+        expected, replay = timed(full)
+        ratings = history.elo_ratings[("channel", None, None)]
+        self.assertLessEqual(len(ratings.checkpoints), MAX_CHECKPOINTS)
+
+        # a stat on the latest game, and one partway back
+        history.register_stat(gametime(count - 1), "p1", "p1", False, "stat.win")
+        _, latest = timed(lambda: history.raw_elo("channel"))
+        history.register_stat(gametime(count // 2), "p1", "p1", False, "stat.win")
+        got, partway = timed(lambda: history.raw_elo("channel"))
+        expected = full()
+        self.assertEqual(
+                { p: (r.ranking, r.games_played) for p, r in got.items() },
+                { p: (r.ranking, r.games_played) for p, r in expected.items() })
+
+        print("elo for {} games: first {:.1f}ms, full replay {:.1f}ms, after a stat on the latest game {:.1f}ms, partway back {:.1f}ms".format(
+            count, first * 1e3, replay * 1e3, latest * 1e3, partway * 1e3), file=sys.stderr)
+        # replaying a game or two against all of them - nowhere near close
+        self.assertLess(latest, replay)
+
+    def test_history_elo_ratings_are_bounded(self):
+        history = PS4History()
+        history.replay(["add-game", "1500000000.000100", "channel", "p1,p2", "normal"])
+        history.register_stat("1500000000.000100", "p1", "p1", False, "stat.win")
+
+        for k in range(CACHED_ELO_RATINGS * 2):
+            history.raw_elo("channel", k_factor = k + 1)
+        self.assertEqual(len(history.elo_ratings), CACHED_ELO_RATINGS)
+        self.assertIn(("channel", None, CACHED_ELO_RATINGS * 2), history.elo_ratings)
+        self.assertNotIn(("channel", None, 1), history.elo_ratings)
+
+    def test_history_aggregates_follow_changes(self):
+        history = PS4History()
+
+        game2017 = "1500000000.000100"
+        game2018 = "1530000000.000100"
+        history.replay(["add-game", game2017, "channel", "p1,p2", "normal"])
+        history.replay(["add-game", game2018, "channel", "p1,p2", "normal"])
+        history.register_stat(game2017, "p1", "p1", False, "stat.win")
+        history.register_stat(game2018, "p2", "p1", False, "stat.win")
+
+        stats = history.raw_stats("channel")
+        self.assertEqual(stats[None]["p1"][Keys.played], 2)
+        self.assertEqual(stats[None]["p1"]["stat.win"], 1)
+        self.assertEqual(history.user_ranking("channel", datetime.datetime(2017, 1, 1)), ["p1", "p2"])
+
+        year = datetime.datetime(2018, 1, 1)
+        stats = history.raw_stats("channel", year)
+        self.assertEqual(stats[None]["p2"]["stat.win"], 1)
+        self.assertEqual(stats[None]["p1"].get("stat.win", 0), 0)
+
+        history.replay(["remove-stat", game2018, "stat.win", "p2", "p1"])
+        history.replay(["cancel-game", game2017])
+        self.assertEqual(dict(history.raw_stats("channel", year)), {
+            None: { "p1": { Keys.played: 1, Keys.game_wins: 0, Keys.winratio: "0.00" },
+                    "p2": { Keys.played: 1, Keys.game_wins: 0, Keys.winratio: "0.00" } } })
+        self.assertEqual(dict(history.raw_stats("other")), {})
+
+    def test_history_champions_invalidated_by_changes_in_scope(self):
+        history = PS4History()
+
+        game2017 = "1500000000.000100"
+        game2018 = "1530000000.000100"
+        history.replay(["add-game", game2017, "channel", "p1,p2,p3,p4", "normal"])
+        history.replay(["add-game", game2018, "channel", "p1,p2,p3,p4", "normal"])
+        history.register_stat(game2017, "p4", "p4", False, "stat.win")
+
+        year2017 = datetime.datetime(2017, 1, 1)
+        year2018 = datetime.datetime(2018, 1, 1)
+        self.assertEqual(history.champions("channel", year2017)[0], "p4")
+        self.assertEqual(history.champions("channel")[0], "p4")
+        cached2017 = history.champions("channel", year2017)
+
+        history.register_stat(game2018, "p3", "p3", False, "stat.win")
+        self.assertIs(history.champions("channel", year2017), cached2017)
+        self.assertEqual(history.champions("channel", year2018)[0], "p3")
+        self.assertEqual(sorted(history.champions("channel")[:2]), ["p3", "p4"])
+
+    def test_history_games_share_strings(self):
+        history = PS4History()
+
+        for i in range(2):
+            gametime = "{}.000100".format(1500000000 + i)
+            history.replay(["add-game", gametime, "".join(["chan", "nel"]), "p1,p2", "normal"])
+            history.replay(["add-stat", gametime, "".join(["stat.", "win"]), "p1", "p2"])
+
+        game1, game2 = history.games
+        self.assertFalse(hasattr(game1, "__dict__"))
+        self.assertIs(game1.channel, game2.channel)
+        self.assertIs(game1.players[0], game2.players[0])
+        stat1, stat2 = next(iter(game1.stats)), next(iter(game2.stats))
+        self.assertIs(stat1.stat, stat2.stat)
+        self.assertEqual((stat1.stat, stat1.user, stat1.voter), ("stat.win", "p1", "p2"))
+
+    def test_stats_dedupe_votes(self):
+        stats = Stats()
+        stats.add("stat.win", "p1", "p1")
+        stats.add("stat.win", "p1", "p2")
+        stats.add("stat.win", "p1", "p2") # duplicate
+        stats.add("stat.scrub", "p2", "p1")
+        stats.remove("stat.scrub", "p2", "p2") # not present
+
+        self.assertEqual(len(stats), 3)
+        self.assertIn(("stat.win", "p1", "p2"), stats)
+
+        stats.remove("stat.win", "p1", "p1")
+        self.assertEqual([tuple(s) for s in stats], [("stat.win", "p1", "p2"), ("stat.scrub", "p2", "p1")])
+        self.assertNotIn(("stat.win", "p1", "p1"), stats)
+
+        history = PS4History(set(["stat.scrub"]))
+        history.replay(["add-game", "1500000000.000100", "channel", "p1,p2", "normal"])
+        history.register_stat("1500000000.000100", "p2", "p1", False, "stat.scrub")
+        game = history.find_game("1500000000.000100")
+        self.assertFalse(history.user_has_winstat_in_game("p2", game))
+        history.register_stat("1500000000.000100", "p2", "p1", False, "stat.win")
+        self.assertTrue(history.user_has_winstat_in_game("p2", game))
+
+    def test_journal_ignores_torn_record(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "journal")
+            journal = Journal(path)
+            journal.open()
+            journal.append("cancel-game", "1")
+            journal.append("cancel-game", "2")
+            journal.close()
+
+            with open(path, "a") as f:
+                f.write("cancel-ga")
+
+            self.assertEqual(Journal(path).replay(), [["cancel-game", "1"], ["cancel-game", "2"]])
+
 if __name__ == '__main__':
     unittest.main()
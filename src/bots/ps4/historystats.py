@@ -1,32 +1,49 @@
-from functional import find
+from collections import namedtuple
+import sys
+
+def intern_str(s):
+    return sys.intern(s) if isinstance(s, str) else s
 
 # represents the stats for a single game
 class Stats:
-    class Stat:
-        def __init__(self, stat, user, voter):
-            self.stat = stat
-            self.user = user
-            self.voter = voter
+    class Stat(namedtuple("Stat", ["stat", "user", "voter"])):
+        __slots__ = ()
 
         def has(self, stat, user, voter):
-            return self.stat == stat and \
-                    self.user == user and \
-                    self.voter == voter
+            return self == (stat, user, voter)
+
+    __slots__ = ("stats",)
 
     def __init__(self):
+        # a game has only a handful of stats, so a list (scanned for lookups
+        # and counts) is both smaller and about as quick as anything indexed
         self.stats = []
 
+    @classmethod
+    def of(cls, entries):
+        """
+        Stats holding entries, a list of distinct Stat tuples, as is
+        """
+        stats = cls.__new__(cls)
+        stats.stats = entries
+        return stats
+
     def __iter__(self):
         return self.stats.__iter__()
 
+    def __len__(self):
+        return len(self.stats)
+
+    def __contains__(self, stat_user_voter):
+        return stat_user_voter in self.stats
+
     def add(self, stat, user, voter):
-        already = find(lambda s: s.has(stat, user, voter), self.stats)
-        if already:
+        if (stat, user, voter) in self.stats:
             return
-
-        self.stats.append(Stats.Stat(stat, user, voter))
+        self.stats.append(Stats.Stat(intern_str(stat), intern_str(user), intern_str(voter)))
 
     def remove(self, stat, user, voter):
-        found = find(lambda s: s.has(stat, user, voter), self.stats)
-        if found:
-            self.stats.remove(found)
+        try:
+            self.stats.remove((stat, user, voter))
+        except ValueError:
+            pass
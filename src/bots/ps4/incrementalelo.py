@@ -0,0 +1,73 @@
+from .elo import apply_game, Player, HistoricalRank
+
+CHECKPOINT_EVERY = 50 # games, to start with
+MAX_CHECKPOINTS = 32 # past this, every other one's dropped and they're taken half as often
+
+def checkpoint(players):
+    """
+    Just enough of each player to carry on ranking from: their ranking, games
+    played and the bounded history of ranks get_history() looks at
+    """
+    return { id: (p.ranking, p.games_played, tuple(r.rank for r in p.historical_ranking))
+            for id, p in players.items() }
+
+def restore(saved):
+    players = {}
+    for id, (ranking, games_played, ranks) in saved.items():
+        player = players[id] = Player(id, ranking)
+        player.games_played = games_played
+        # the teams and deltas behind restored ranks aren't kept, nothing reads them back
+        player.historical_ranking.extend(HistoricalRank(rank, None, None, 1) for rank in ranks)
+    return players
+
+class IncrementalElo:
+    """
+    Elo rankings over a sequence of historic games that (mostly) grows at the end
+
+    New games are applied on top of the current rankings. Changing a game
+    that's already been applied rolls the rankings back to the last
+    checkpoint at or before it, and the games from there are replayed on
+    the next update().
+    """
+    def __init__(self, k_factor, convert):
+        self.k_factor = k_factor
+        self.convert = convert # historic game => elo.Game, or None if it can't be ranked
+        self.players = {}
+        self.applied = 0 # how many of the games have been applied
+        self.positions = {} # message timestamp => index in the games
+        self.checkpoint_every = CHECKPOINT_EVERY
+        self.checkpoints = [(0, {})] # [(applied, checkpoint(players)), ...]
+
+    def update(self, games_from):
+        """
+        games_from(start) iterates over the games from the start'th on
+        """
+        for index, game in enumerate(games_from(self.applied), self.applied):
+            self.positions[game.message_timestamp] = index
+
+            elo_game = self.convert(game)
+            if elo_game is not None:
+                apply_game(self.players, elo_game, self.k_factor)
+
+            self.applied = index + 1
+            if self.applied % self.checkpoint_every == 0 and self.checkpoints[-1][0] < self.applied:
+                self.checkpoints.append((self.applied, checkpoint(self.players)))
+                if len(self.checkpoints) > MAX_CHECKPOINTS:
+                    self.checkpoint_every *= 2
+                    self.checkpoints = [c for c in self.checkpoints if c[0] % self.checkpoint_every == 0]
+
+        return self.players
+
+    def invalidate(self, gametime, removed = False):
+        index = self.positions.get(gametime)
+        if removed:
+            self.positions.pop(gametime, None)
+        if index is None or index >= self.applied:
+            # not applied yet, it'll be picked up as it is
+            return
+
+        while self.checkpoints[-1][0] > index:
+            self.checkpoints.pop()
+
+        self.applied, saved = self.checkpoints[-1]
+        self.players = restore(saved)
@@ -0,0 +1,81 @@
+import os
+import sys
+
+FSYNC_EVERY = 20 # records
+
+class Journal:
+    """
+    An append-only log of records, each a line of space-separated tokens
+
+    Records are flushed as they're written, and fsync'd every FSYNC_EVERY
+    records (or on sync()). A torn final line, from a crash mid-write, is
+    ignored on replay.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+        self.records = 0
+        self.unsynced = 0
+
+    def replay(self):
+        """
+        Returns the token lists of every complete record, counting them
+        """
+        records = []
+        try:
+            with open(self.path, "r") as f:
+                for line in iter(f.readline, ""):
+                    if not line.endswith("\n"):
+                        print("ignoring torn {} record \"{}\"".format(self.path, line), file=sys.stderr)
+                        break
+                    records.append(line.rstrip("\n").split(" "))
+        except IOError:
+            pass
+
+        self.records = len(records)
+        return records
+
+    def open(self):
+        self.f = open(self.path, "a")
+
+    def append(self, *tokens):
+        if self.f is None:
+            return
+
+        try:
+            print(" ".join(tokens), file=self.f)
+            self.f.flush()
+        except IOError as e:
+            print("exception writing {}: {}".format(self.path, e), file=sys.stderr)
+            return
+
+        self.records += 1
+        self.unsynced += 1
+        if self.unsynced >= FSYNC_EVERY:
+            self.sync()
+
+    def sync(self):
+        if self.f is None or self.unsynced == 0:
+            return
+        try:
+            os.fsync(self.f.fileno())
+        except OSError as e:
+            print("exception syncing {}: {}".format(self.path, e), file=sys.stderr)
+        self.unsynced = 0
+
+    def truncate(self):
+        """
+        Discards every record, once they've been captured elsewhere (i.e. in a snapshot)
+        """
+        if self.f is not None:
+            self.f.close()
+        self.f = open(self.path, "w")
+        self.records = 0
+        self.unsynced = 0
+
+    def close(self):
+        if self.f is None:
+            return
+        self.sync()
+        self.f.close()
+        self.f = None
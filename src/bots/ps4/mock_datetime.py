@@ -74,6 +74,9 @@ class StubDate:
     def __ne__(self, other):
         return not (self == other)
 
+    def __hash__(self):
+        return hash((self.hour, self.minute))
+
     def __repr__(self):
         return "StubDate(h={}, m={}, s={}, ms={})".format(
                 self.hour,
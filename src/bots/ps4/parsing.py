@@ -4,7 +4,7 @@ import re
 import sys
 from functools import cmp_to_key
 
-from bots.ps4.cfg import default_max_players, PLAY_TIME
+from bots.ps4.cfg import default_max_players, PLAY_TIME, PARAMETER_SWEEP_STEP, PARAMETER_SWEEP_MAX
 from bots.ps4.gamecategory import channel_is_football_tournament
 
 DEBUG = False
@@ -12,6 +12,8 @@ ENABLE_3_DIGIT_TIME = False # allow 230, etc as time
 
 competitive_re = re.compile("compet|competitive|1v1", re.IGNORECASE)
 parameter_re = re.compile('^([a-z]+)=(.*)', re.IGNORECASE)
+parameter_sweep_re = re.compile(r'^(\d+)\.\.(\d+)$')
+SWEEPABLE_PARAMETERS = set(["k"]) # only elo's k factor has a sweep (see PS4Bot.send_elo_sweep)
 banned_ats_re = re.compile("<!(here|channel)>", re.IGNORECASE)
 
 game_time_re = re.compile(r"\b(at )?(half )?((?<!-)(\d+([:.]?\d+)?)([a-z]*))\b", re.IGNORECASE)
@@ -140,8 +142,24 @@ def parse_stats_request(request):
 
         parameter_match = parameter_re.search(part)
         if parameter_match:
+            name, value = parameter_match.group(1).lower(), parameter_match.group(2)
+
+            sweep_match = parameter_sweep_re.search(value)
+            if sweep_match:
+                if name not in SWEEPABLE_PARAMETERS:
+                    return None
+                # "k=10..40" => parameters["k_sweep"] = [10, 15, ... 40]
+                low, high = int(sweep_match.group(1)), int(sweep_match.group(2))
+                sweep = list(range(low, high + 1, PARAMETER_SWEEP_STEP))
+                if len(sweep) and sweep[-1] != high:
+                    sweep.append(high)
+                if len(sweep) == 0 or len(sweep) > PARAMETER_SWEEP_MAX:
+                    return None
+                parameters[name + "_sweep"] = sweep
+                continue
+
             try:
-                parameters[parameter_match.group(1).lower()] = int(parameter_match.group(2))
+                parameters[name] = int(value)
                 continue
             except ValueError:
                 return None
@@ -5,7 +5,8 @@ import sys
 fcwd = path.dirname(__file__)
 sys.path.insert(0, path.abspath("{}/../../".format(fcwd)))
 
-from parsing import parse_time
+from parsing import parse_time, parse_stats_request
+from bots.ps4.cfg import PARAMETER_SWEEP_MAX
 
 class TestPS4Parsing(unittest.TestCase):
     def assertParseTime(self, desc, expected_hour, expected_minute):
@@ -107,6 +108,23 @@ class TestPS4Parsing(unittest.TestCase):
         with self.assertRaises(ValueError):
             parse_time("1:60")
 
+    def test_stats_parameter_sweep(self):
+        channel, year, parameters = parse_stats_request("towerfall 2018 k=10..40 h=3")
+        self.assertEqual(channel, "towerfall")
+        self.assertEqual(year.year, 2018)
+        self.assertEqual(parameters["k_sweep"], [10, 15, 20, 25, 30, 35, 40])
+        self.assertEqual(parameters["h"], 3)
+        self.assertIsNone(parameters["k"])
+
+        self.assertEqual(parse_stats_request("k=10..12")[2]["k_sweep"], [10, 12])
+        self.assertIsNone(parse_stats_request("k=40..10"))
+        self.assertIsNone(parse_stats_request("k=1..1000"))
+        # 10, 15, ... 55 and 57 would be one too many
+        self.assertIsNone(parse_stats_request("k=10..57"))
+        self.assertEqual(len(parse_stats_request("k=10..55")[2]["k_sweep"]), PARAMETER_SWEEP_MAX)
+        # nothing but k can be swept
+        self.assertIsNone(parse_stats_request("h=1..5"))
+
     def test_fractional(self):
         self.assertParseTime2("half", "3", 15, 30)
         self.assertParseTime2("half", "12", 12, 30)
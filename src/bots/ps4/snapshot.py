@@ -0,0 +1,225 @@
+import datetime
+import os
+import struct
+import sys
+
+from .historicgame import PS4HistoricGame
+from .historystats import Stats
+
+# binary snapshot:
+#   header: MAGIC, version
+#   strings: count, then (length, utf-8 bytes) for each
+#   games: count, then for each:
+#     timestamp kind, seconds, micros, channel, mode, player count, stat count
+#   indices: count, then each game's player string indices, followed by
+#     (stat, user, voter) string indices for each of its stats
+#
+# version 1 had 16-bit string lengths, and each game's indices straight after it
+MAGIC = b"PS4S"
+VERSION = 2
+
+HEADER = struct.Struct("<4sH")
+COUNT = struct.Struct("<I")
+STRING_LEN = struct.Struct("<I")
+STRING_LEN_V1 = struct.Struct("<H")
+GAME = struct.Struct("<BqIIIHH")
+
+NO_STRING = 0xffffffff
+
+DATE_FMT = "%H:%M" # how the text format wrote datetimes
+JOURNAL_DATE_FMT = "%Y-%m-%dT%H:%M:%S.%f"
+
+class TimestampKind:
+    slack = 0 # slack's "seconds.micros" message timestamp
+    local = 1 # a (naive, local) datetime
+    other = 2 # anything else, kept as a string in the table
+
+class SnapshotError(Exception):
+    pass
+
+def serialise_timestamp(timestamp):
+    if isinstance(timestamp, datetime.datetime):
+        return timestamp.strftime(JOURNAL_DATE_FMT)
+    return timestamp # slack's "seconds.micros" string
+
+def deserialise_timestamp(s):
+    try:
+        float(s)
+        return s
+    except ValueError:
+        pass
+    try:
+        return datetime.datetime.strptime(s, JOURNAL_DATE_FMT)
+    except ValueError:
+        # the text format (and older journals), which lost the date
+        return datetime.datetime.strptime(s, DATE_FMT)
+
+def split_slack_timestamp(ts):
+    seconds, sep, micros = ts.partition(".")
+    if sep and seconds.isdigit() and micros.isdigit() and len(micros) == 6:
+        return int(seconds), int(micros)
+    return None
+
+def write_snapshot(path, games):
+    strings = {}
+    def string_index(s):
+        if s is None:
+            return NO_STRING
+        return strings.setdefault(s, len(strings))
+
+    headers = []
+    indices = []
+    for g in games:
+        ts = g.message_timestamp
+        slack_ts = split_slack_timestamp(ts) if isinstance(ts, str) else None
+        if isinstance(ts, datetime.datetime):
+            kind, seconds, micros = TimestampKind.local, int(ts.timestamp() // 1), ts.microsecond
+        elif slack_ts:
+            kind, (seconds, micros) = TimestampKind.slack, slack_ts
+        else:
+            kind, seconds, micros = TimestampKind.other, 0, string_index(str(ts))
+
+        stats = list(g.stats)
+        headers.append(GAME.pack(kind, seconds, micros,
+            string_index(g.channel), string_index(g.mode), len(g.players), len(stats)))
+
+        indices.extend(string_index(p) for p in g.players)
+        for stat in stats:
+            indices.extend((string_index(stat.stat), string_index(stat.user), string_index(stat.voter)))
+
+    out = [HEADER.pack(MAGIC, VERSION), COUNT.pack(len(strings))]
+    for s in strings:
+        encoded = s.encode("utf-8")
+        out.append(STRING_LEN.pack(len(encoded)))
+        out.append(encoded)
+    out.append(COUNT.pack(len(games)))
+    out.extend(headers)
+    out.append(COUNT.pack(len(indices)))
+    out.append(struct.pack("<{}I".format(len(indices)), *indices))
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(b"".join(out))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def read_snapshot(path):
+    """
+    Returns the games in the snapshot, raising SnapshotError if it's not one we understand
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    try:
+        magic, version = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise SnapshotError("{} isn't a snapshot".format(path))
+        if version not in (1, VERSION):
+            raise SnapshotError("{} is snapshot version {}, expected {}".format(path, version, VERSION))
+        offset = HEADER.size
+
+        string_len = STRING_LEN if version >= 2 else STRING_LEN_V1
+        (nstrings,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+        strings = []
+        for _ in range(nstrings):
+            (length,) = string_len.unpack_from(data, offset)
+            offset += string_len.size
+            if offset + length > len(data):
+                raise SnapshotError("{} is truncated".format(path))
+            strings.append(sys.intern(data[offset:offset + length].decode("utf-8")))
+            offset += length
+
+        (ngames,) = COUNT.unpack_from(data, offset)
+        offset += COUNT.size
+
+        if version == 1:
+            headers, indices = [], []
+            for _ in range(ngames):
+                header = GAME.unpack_from(data, offset)
+                offset += GAME.size
+                nindices = header[5] + 3 * header[6]
+                indices.extend(struct.unpack_from("<{}I".format(nindices), data, offset))
+                offset += 4 * nindices
+                headers.append(header)
+            indices = tuple(indices)
+        else:
+            end = offset + ngames * GAME.size
+            if end > len(data):
+                raise SnapshotError("{} is truncated".format(path))
+            headers = GAME.iter_unpack(memoryview(data)[offset:end])
+            offset = end
+            (nindices,) = COUNT.unpack_from(data, offset)
+            offset += COUNT.size
+            indices = struct.unpack_from("<{}I".format(nindices), data, offset)
+
+        return build_games(headers, indices, strings)
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise SnapshotError("{} is corrupt: {}".format(path, e))
+
+def build_games(headers, indices, strings):
+    # the strings are already interned, so games and stats are put together
+    # directly, rather than through PS4HistoricGame() and Stats.add()
+    def string_at(i):
+        return None if i == NO_STRING else strings[i]
+
+    stat_entries = {} # (stat, user, voter) indices => Stat, shared between games
+    make_stat = Stats.Stat._make
+    games = []
+    pos = 0
+    for kind, seconds, micros, channel, mode, nplayers, nstats in headers:
+        if kind == TimestampKind.slack:
+            timestamp = "{}.{:06d}".format(seconds, micros)
+        elif kind == TimestampKind.local:
+            timestamp = datetime.datetime.fromtimestamp(seconds).replace(microsecond = micros)
+        else:
+            timestamp = strings[micros]
+
+        players = [strings[i] for i in indices[pos:pos + nplayers]]
+        pos += nplayers
+
+        entries = []
+        for _ in range(nstats):
+            key = indices[pos:pos + 3]
+            pos += 3
+            entry = stat_entries.get(key)
+            if entry is None:
+                entry = stat_entries[key] = make_stat(strings[i] for i in key)
+            entries.append(entry)
+
+        games.append(PS4HistoricGame.restore(timestamp, players,
+            string_at(channel), string_at(mode), Stats.of(entries)))
+
+    if pos != len(indices):
+        raise IndexError("{} indices left over".format(len(indices) - pos))
+    return games
+
+def read_text_snapshot(path):
+    """
+    Returns the games in the original, text, format: one "game" line each,
+    followed by its "stat" lines
+    """
+    games = []
+    with open(path, "r") as f:
+        current_game = None
+        for line in iter(f.readline, ""):
+            line = line.rstrip("\n").lstrip(" ")
+            tokens = line.split(" ")
+
+            if tokens[0] == "game":
+                message_timestamp = deserialise_timestamp(tokens[1])
+                channel = tokens[2]
+                players = [t for t in tokens[3].split(",") if len(t)]
+                mode = None if tokens[4] == "normal" else tokens[4]
+                current_game = PS4HistoricGame(message_timestamp, players, channel, mode)
+                games.append(current_game)
+            elif tokens[0] == "stat":
+                if not current_game:
+                    print("found stat \"{}\" without game".format(tokens[1]), file=sys.stderr)
+                    continue
+                stat, user, voter = tokens[1:]
+                current_game.stats.add(stat, user, voter)
+            else:
+                print("unknown {} line \"{}\"".format(path, line), file=sys.stderr)
+    return games
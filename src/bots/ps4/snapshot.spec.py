@@ -0,0 +1,166 @@
+import unittest
+
+import sys
+
+from os import path
+fcwd = path.dirname(__file__)
+sys.path.insert(0, path.abspath("{}/../../".format(fcwd)))
+
+import datetime
+import os
+import struct
+import tempfile
+import time
+from bots.ps4.historicgame import PS4HistoricGame
+from bots.ps4.history import PS4History
+from bots.ps4.game import Game
+from msg.slackpostedmessage import SlackPostedMessage
+from bots.ps4.snapshot import write_snapshot, read_snapshot, read_text_snapshot, \
+        serialise_timestamp, deserialise_timestamp, SnapshotError, MAGIC, GAME, NO_STRING
+
+def make_games(count):
+    games = []
+    for i in range(count):
+        game = PS4HistoricGame(
+                "{}.{:06d}".format(1500000000 + i * 3600, i % 1000000),
+                ["p{}".format((i + j) % 10) for j in range(4)],
+                "channel{}".format(i % 3),
+                None if i % 5 else "compet")
+        game.stats.add("stat.win", game.players[0], game.players[1])
+        game.stats.add("stat.scrub", game.players[2], game.players[0])
+        games.append(game)
+    return games
+
+def write_text(filename, games):
+    with open(filename, "w") as f:
+        for g in games:
+            print("game {} {} {} {}".format(
+                serialise_timestamp(g.message_timestamp), g.channel, ",".join(g.players), g.mode or "normal"), file=f)
+            for stat in g.stats:
+                print("  stat {} {} {}".format(stat.stat, stat.user, stat.voter), file=f)
+
+def write_v1(filename, games):
+    # version 1: 16-bit string lengths, each game's indices straight after it
+    strings = {}
+    def index(s):
+        return NO_STRING if s is None else strings.setdefault(s, len(strings))
+
+    body = []
+    for g in games:
+        seconds, micros = g.message_timestamp.split(".")
+        body.append(GAME.pack(0, int(seconds), int(micros), index(g.channel), index(g.mode), len(g.players), len(g.stats)))
+        indices = [index(p) for p in g.players] + [index(x) for stat in g.stats for x in stat]
+        body.append(struct.pack("<{}I".format(len(indices)), *indices))
+
+    out = [struct.pack("<4sH", MAGIC, 1), struct.pack("<I", len(strings))]
+    for s in strings:
+        out.append(struct.pack("<H", len(s.encode("utf-8"))) + s.encode("utf-8"))
+    out.append(struct.pack("<I", len(games)))
+    with open(filename, "wb") as f:
+        f.write(b"".join(out + body))
+
+def best_of(n, fn):
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def describe(games):
+    return [(g.message_timestamp, g.players, g.channel, g.mode, [tuple(s) for s in g.stats]) for g in games]
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.binary = os.path.join(self.tmp.name, "ps4-stats.bin")
+        self.text = os.path.join(self.tmp.name, "ps4-stats.txt")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_snapshot_round_trip(self):
+        games = make_games(20)
+        games.append(PS4HistoricGame(datetime.datetime(2019, 3, 4, 15, 30, 0, 1234), ["p1"], "channel", None))
+        games.append(PS4HistoricGame("not-a-slack-ts", [], "channel", None))
+
+        write_snapshot(self.binary, games)
+        self.assertEqual(describe(read_snapshot(self.binary)), describe(games))
+
+    def test_snapshot_long_strings(self):
+        games = make_games(2)
+        games[0].channel = "c" * 70000
+        write_snapshot(self.binary, games)
+        self.assertEqual(describe(read_snapshot(self.binary)), describe(games))
+
+    def test_snapshot_reads_version_1(self):
+        games = make_games(50)
+        write_v1(self.binary, games)
+        self.assertEqual(describe(read_snapshot(self.binary)), describe(games))
+
+    def test_journal_timestamps_keep_their_date(self):
+        when = datetime.datetime(2019, 3, 4, 15, 30, 0, 1234)
+        self.assertEqual(deserialise_timestamp(serialise_timestamp(when)), when)
+        self.assertEqual(deserialise_timestamp("1500000000.000001"), "1500000000.000001")
+        # older journals only have the time
+        self.assertEqual(deserialise_timestamp("15:30").strftime("%H:%M"), "15:30")
+
+    def test_snapshot_migrated_from_text(self):
+        games = make_games(50)
+        write_text(self.text, games)
+
+        write_snapshot(self.binary, read_text_snapshot(self.text))
+        self.assertEqual(describe(read_snapshot(self.binary)), describe(games))
+
+    def test_snapshot_rejects_corruption(self):
+        write_snapshot(self.binary, make_games(5))
+        with open(self.binary, "rb") as f:
+            data = f.read()
+
+        with open(self.binary, "wb") as f:
+            f.write(data[:-3])
+        with self.assertRaises(SnapshotError):
+            read_snapshot(self.binary)
+
+        with open(self.binary, "wb") as f:
+            f.write(b"game " + data)
+        with self.assertRaises(SnapshotError):
+            read_snapshot(self.binary)
+
+    def test_history_reloads_saved_snapshot(self):
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name) # the history's files are relative
+        try:
+            history = PS4History(set(["stat.scrub"]))
+            now = datetime.datetime.today()
+            for i in range(30):
+                ts = "{}.{:06d}".format(1500000000 + i * 3600, i)
+                game = Game(now, "desc", "games", "p0", SlackPostedMessage("games", ts, None), 4, 30, None, False)
+                game.add_player("p{}".format(i % 5 + 1))
+                history.add_game(game)
+                history.register_stat(ts, "p0", "p1", False, "stat.win")
+            history.save()
+
+            reloaded = PS4History(set(["stat.scrub"]))
+            self.assertTrue(os.path.exists("ps4-stats.bin"))
+            self.assertEqual(describe(reloaded.games), describe(history.games))
+        finally:
+            os.chdir(cwd)
+
+    def test_snapshot_load_benchmark(self):
+        games = make_games(20000)
+        write_text(self.text, games)
+        write_snapshot(self.binary, games)
+
+        text = best_of(3, lambda: read_text_snapshot(self.text))
+        binary = best_of(3, lambda: read_snapshot(self.binary))
+
+        print("loading {} games: snapshot {:.0f}ms ({} bytes), text {:.0f}ms ({} bytes)".format(
+            len(games),
+            binary * 1e3, os.path.getsize(self.binary),
+            text * 1e3, os.path.getsize(self.text)), file=sys.stderr)
+        self.assertEqual(describe(read_snapshot(self.binary)), describe(games))
+        self.assertEqual(describe(read_text_snapshot(self.text)), describe(games))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,368 @@
+import datetime
+import sqlite3
+import sys
+import threading
+
+from .historicgame import PS4HistoricGame
+from .journal import Journal
+from .snapshot import write_snapshot, read_snapshot, read_text_snapshot, \
+        serialise_timestamp, deserialise_timestamp
+
+SAVE_FILE = "ps4-stats.bin"
+LEGACY_SAVE_FILE = "ps4-stats.txt" # read if there's no SAVE_FILE yet
+JOURNAL_FILE = "ps4-stats.journal"
+COMPACT_AFTER = 1000 # journal records
+SQLITE_FILE = "ps4-stats.sqlite"
+QUERY_CHUNK = 500 # games fetched at a time by SqliteStorage.games()
+
+class Storage:
+    """
+    Where PS4History keeps its games
+
+    Changes are passed to record() as the same records the journal holds
+    ("add-game", timestamp, channel, players, mode / "cancel-game", timestamp /
+    "add-stat" or "remove-stat", timestamp, stat, user, voter /
+    "players", timestamp, players / "add-player" or "remove-player", timestamp, user).
+    """
+    counts_stats = False # whether stat_totals() is available
+    keeps_games = False # whether find_game() and games() are, so the history needn't hold every game
+
+    def load(self):
+        """
+        Returns (games, records): the saved games, and records to replay on top of them
+        """
+        return [], [] # abstract
+
+    def record(self, *tokens):
+        pass # abstract
+
+    def flush(self, games):
+        """
+        Makes sure recent changes are on disk. games is everything, should the
+        backend want to rewrite it
+        """
+        pass # abstract
+
+    def save(self, games):
+        pass # abstract
+
+    def close(self):
+        pass
+
+class FileStorage(Storage):
+    """
+    SAVE_FILE, a snapshot, plus JOURNAL_FILE, the changes made since.
+    Each change is appended to the journal, and once that grows past
+    COMPACT_AFTER records, it's folded into a new snapshot.
+    """
+    def __init__(self, save_file = SAVE_FILE, journal_file = JOURNAL_FILE, legacy_file = LEGACY_SAVE_FILE):
+        self.save_file = save_file
+        self.legacy_file = legacy_file
+        self.journal = Journal(journal_file)
+
+    def load(self):
+        games = []
+        try:
+            games = read_snapshot(self.save_file)
+        except FileNotFoundError:
+            try:
+                games = read_text_snapshot(self.legacy_file)
+            except IOError:
+                pass
+        except IOError as e:
+            print("exception loading state: {}".format(e), file=sys.stderr)
+
+        self.journal.close()
+        records = self.journal.replay()
+        self.journal.open()
+        return games, records
+
+    def record(self, *tokens):
+        self.journal.append(*tokens)
+
+    def flush(self, games):
+        if self.journal.records >= COMPACT_AFTER:
+            self.save(games)
+        else:
+            self.journal.sync()
+
+    def save(self, games):
+        """
+        Writes a snapshot of every game, then empties the journal
+        """
+        try:
+            write_snapshot(self.save_file, games)
+        except IOError as e:
+            print("exception saving state: {}".format(e), file=sys.stderr)
+            return
+
+        self.journal.truncate()
+
+    def close(self):
+        self.journal.close()
+
+def timestamp_year(ts):
+    try:
+        timestamp = deserialise_timestamp(ts)
+        if isinstance(timestamp, datetime.datetime):
+            return timestamp.year
+        return datetime.datetime.fromtimestamp(float(timestamp)).year
+    except (TypeError, ValueError):
+        return None
+
+class SqliteStorage(Storage):
+    """
+    Games, players and stats as SQLite tables, indexed by channel, year and
+    timestamp. Each change is applied as it's recorded and committed on flush().
+    Stats are totalled in SQL, and games are read back as they're needed,
+    rather than all being kept in memory.
+
+    The connection's shared between the event, scheduler and dispatcher
+    threads, so everything that touches it holds self.lock.
+    """
+    counts_stats = True
+    keeps_games = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY,
+            ts TEXT NOT NULL UNIQUE,
+            channel TEXT NOT NULL,
+            year INTEGER,
+            mode TEXT
+        );
+        CREATE INDEX IF NOT EXISTS games_channel_year ON games (channel, year);
+        CREATE INDEX IF NOT EXISTS games_year ON games (year);
+
+        CREATE TABLE IF NOT EXISTS players (
+            game_id INTEGER NOT NULL REFERENCES games (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            user TEXT NOT NULL,
+            PRIMARY KEY (game_id, position)
+        );
+
+        CREATE TABLE IF NOT EXISTS stats (
+            id INTEGER PRIMARY KEY,
+            game_id INTEGER NOT NULL REFERENCES games (id) ON DELETE CASCADE,
+            stat TEXT NOT NULL,
+            user TEXT NOT NULL,
+            voter TEXT NOT NULL,
+            UNIQUE (game_id, stat, user, voter)
+        );
+    """
+
+    def __init__(self, path = SQLITE_FILE):
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(self.SCHEMA)
+
+    def load(self):
+        # nothing's held in memory up front, see find_game() and games()
+        return [], []
+
+    def is_empty(self):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM games LIMIT 1").fetchone() is None
+
+    def import_games(self, games, records):
+        """
+        Copies in another storage's games and the records to replay on them,
+        e.g. FileStorage's snapshot and journal
+        """
+        with self.lock:
+            for g in games:
+                ts = serialise_timestamp(g.message_timestamp)
+                self.apply("add-game", ts, g.channel, ",".join(g.players), g.mode or "normal")
+                for stat in g.stats:
+                    self.apply("add-stat", ts, stat.stat, stat.user, stat.voter)
+            for record in records:
+                self.apply(*record)
+            self.db.commit()
+
+    def read_games(self, rows):
+        """
+        PS4HistoricGames for rows of (id, ts, channel, mode)
+        """
+        games = { id: PS4HistoricGame(deserialise_timestamp(ts), [], channel, mode)
+                for id, ts, channel, mode in rows }
+        if len(games) == 0:
+            return []
+
+        ids = ",".join("?" * len(games))
+        players = {}
+        for id, user in self.db.execute(
+                "SELECT game_id, user FROM players WHERE game_id IN ({}) ORDER BY game_id, position".format(ids),
+                list(games)):
+            players.setdefault(id, []).append(user)
+        for id, game_players in players.items():
+            games[id].players = game_players
+
+        for id, stat, user, voter in self.db.execute(
+                "SELECT game_id, stat, user, voter FROM stats WHERE game_id IN ({}) ORDER BY id".format(ids),
+                list(games)):
+            games[id].stats.add(stat, user, voter)
+
+        return list(games.values())
+
+    def find_game(self, ts):
+        with self.lock:
+            found = self.read_games(self.db.execute(
+                "SELECT id, ts, channel, mode FROM games WHERE ts = ?", (ts,)))
+        return found[0] if found else None
+
+    def games(self, channel = None, year = None, start = 0):
+        """
+        The games in the channel (or every channel) and year, in the order they
+        were added, skipping the first `start`. They're read QUERY_CHUNK at a time
+        """
+        conditions, params = [], []
+        if channel:
+            conditions.append("AND channel = ?")
+            params.append(channel)
+        if year:
+            conditions.append("AND year = ?")
+            params.append(year)
+        query = "SELECT id, ts, channel, mode FROM games WHERE id > ? {} ORDER BY id LIMIT ? OFFSET ?".format(
+                " ".join(conditions))
+
+        after, offset = 0, start
+        while True:
+            with self.lock:
+                rows = self.db.execute(query, [after] + params + [QUERY_CHUNK, offset]).fetchall()
+                chunk = self.read_games(rows)
+
+            yield from chunk
+            if len(rows) < QUERY_CHUNK:
+                return
+            after, offset = rows[-1][0], 0
+
+    def game_id(self, ts):
+        row = self.db.execute("SELECT id FROM games WHERE ts = ?", (ts,)).fetchone()
+        return row[0] if row else None
+
+    def set_players(self, id, players):
+        self.db.execute("DELETE FROM players WHERE game_id = ?", (id,))
+        self.db.executemany("INSERT INTO players (game_id, position, user) VALUES (?, ?, ?)",
+                [(id, i, p) for i, p in enumerate(p for p in players.split(",") if len(p))])
+
+    def record(self, *tokens):
+        with self.lock:
+            self.apply(*tokens)
+
+    def apply(self, kind, ts, *rest):
+        if kind == "add-game":
+            channel, players, mode = rest
+            cursor = self.db.execute("INSERT OR IGNORE INTO games (ts, channel, year, mode) VALUES (?, ?, ?, ?)",
+                    (ts, channel, timestamp_year(ts), None if mode == "normal" else mode))
+            if cursor.rowcount:
+                self.set_players(cursor.lastrowid, players)
+            return
+
+        id = self.game_id(ts)
+        if id is None:
+            return
+        if kind == "cancel-game":
+            self.db.execute("DELETE FROM games WHERE id = ?", (id,))
+        elif kind == "add-stat":
+            self.db.execute("INSERT OR IGNORE INTO stats (game_id, stat, user, voter) VALUES (?, ?, ?, ?)",
+                    (id,) + rest)
+        elif kind == "remove-stat":
+            self.db.execute("DELETE FROM stats WHERE game_id = ? AND stat = ? AND user = ? AND voter = ?",
+                    (id,) + rest)
+        elif kind == "players":
+            self.set_players(id, rest[0])
+        elif kind == "add-player":
+            self.db.execute("""INSERT INTO players (game_id, position, user)
+                    SELECT ?, COALESCE(MAX(position) + 1, 0), ? FROM players WHERE game_id = ?""",
+                    (id, rest[0], id))
+        elif kind == "remove-player":
+            self.db.execute("DELETE FROM players WHERE game_id = ? AND user = ?", (id, rest[0]))
+
+    def flush(self, games):
+        with self.lock:
+            self.db.commit()
+
+    def save(self, games):
+        with self.lock:
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+    def stat_totals(self, channel, year, is_positive, single_win, played_key, wins_key):
+        """
+        The same totals as PS4History.raw_stats() (less win ratios), counted in SQL:
+        { mode: { user: { [stat]: int ... }, ... } }, with games played and won
+        under played_key and wins_key
+
+        is_positive(stat) and single_win(channel) are the history's rules for
+        which stats count as wins, and channels that allow one win per game
+        """
+        with self.lock:
+            self.db.create_function("is_positive", 1, lambda stat: bool(is_positive(stat)), deterministic = True)
+            self.db.create_function("single_win", 1, lambda channel: bool(single_win(channel)), deterministic = True)
+
+            conditions, params = [], []
+            if channel:
+                conditions.append("g.channel = ?")
+                params.append(channel)
+            if year:
+                conditions.append("g.year = ?")
+                params.append(year.year)
+            where = "WHERE " + " AND ".join(conditions) if conditions else ""
+
+            totals = {}
+            def add(mode, user, stat, count):
+                if count:
+                    totals.setdefault(mode, {}).setdefault(user, {})[stat] = count
+
+            played = """
+                SELECT g.mode, p.user, COUNT(*),
+                    SUM(EXISTS (SELECT 1 FROM stats s WHERE s.game_id = g.id AND s.user = p.user AND is_positive(s.stat)))
+                FROM games g JOIN players p ON p.game_id = g.id
+                {}
+                GROUP BY g.mode, p.user
+            """.format(where)
+            for mode, user, games, wins in self.db.execute(played, params):
+                add(mode, user, played_key, games)
+                add(mode, user, wins_key, wins)
+
+            # where a channel allows a single win per game, only a user's first winning stat counts
+            stats = """
+                SELECT mode, user, stat, COUNT(*) FROM (
+                    SELECT g.mode, s.user, s.stat, single_win(g.channel) AND is_positive(s.stat) AS limited,
+                        ROW_NUMBER() OVER (PARTITION BY s.game_id, s.user, is_positive(s.stat) ORDER BY s.id) AS nth
+                    FROM games g JOIN stats s ON s.game_id = g.id
+                    {}
+                )
+                WHERE NOT (limited AND nth > 1)
+                GROUP BY mode, user, stat
+            """.format(where)
+            for mode, user, stat, count in self.db.execute(stats, params):
+                add(mode, user, stat, count)
+
+            return totals
+
+def import_file_history(storage):
+    """
+    Copies FileStorage's history into storage, e.g. on first switching to sqlite
+    """
+    files = FileStorage()
+    games, records = files.load()
+    files.close()
+    if len(games) or len(records):
+        print("importing {} games and {} journal records".format(len(games), len(records)), file=sys.stderr)
+        storage.import_games(games, records)
+
+def open_storage(name):
+    if name == "sqlite":
+        storage = SqliteStorage()
+        if storage.is_empty():
+            import_file_history(storage)
+        return storage
+    if name == "file":
+        return FileStorage()
+    raise ValueError("unknown ps4 history storage \"{}\"".format(name))
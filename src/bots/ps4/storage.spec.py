@@ -0,0 +1,153 @@
+import unittest
+
+import sys
+
+from os import path
+fcwd = path.dirname(__file__)
+sys.path.insert(0, path.abspath("{}/../../".format(fcwd)))
+
+import datetime
+import os
+import random
+import tempfile
+from bots.ps4.history import PS4History
+from bots.ps4.storage import FileStorage, SqliteStorage, open_storage
+from bots.ps4.game import Game
+from msg.slackpostedmessage import SlackPostedMessage
+
+def play(history, count, seed = 1):
+    """
+    Records a random history of games, with stats, roster changes and cancellations
+    """
+    rand = random.Random(seed)
+    users = ["p{}".format(i) for i in range(6)]
+    now = datetime.datetime.today()
+
+    games = []
+    for i in range(count):
+        ts = "{}.{:06d}".format(1450000000 + i * 86400 * 7, i)
+        channel = rand.choice(["games", "fifa", "towerfall"])
+        mode = rand.choice([None, None, "compet"])
+        game = Game(now, "desc", channel, users[0], SlackPostedMessage(channel, ts, None), 4, 30, mode, False)
+        for user in rand.sample(users[1:], 3):
+            game.add_player(user)
+        history.add_game(game)
+        games.append(game)
+
+        for _ in range(rand.randrange(4)):
+            voter = rand.choice(game.players)
+            stat = rand.choice(["stat.win", "stat.scrub", "stat.goal"])
+            history.register_stat(ts, rand.choice(game.players), voter, rand.random() < 0.2, stat)
+
+        if rand.random() < 0.1:
+            history.remove_player(ts, game.players[0])
+        if rand.random() < 0.1:
+            history.add_player(ts, users[0])
+        if rand.random() < 0.05:
+            history.cancel_game(game)
+
+def stats_for(history, channel, year):
+    return { mode: { user: dict(s) for user, s in users.items() }
+            for mode, users in history.raw_stats(channel, year).items() }
+
+def elo_for(history, channel, year):
+    return { user: (p.ranking, p.games_played) for user, p in history.raw_elo(channel, year).items() }
+
+class TestStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def file_storage(self):
+        return FileStorage(
+                os.path.join(self.tmp.name, "ps4-stats.bin"),
+                os.path.join(self.tmp.name, "ps4-stats.journal"),
+                os.path.join(self.tmp.name, "ps4-stats.txt"))
+
+    def sqlite_storage(self):
+        return SqliteStorage(os.path.join(self.tmp.name, "ps4-stats.sqlite"))
+
+    def assertSameHistory(self, a, b):
+        def describe(h):
+            return [(g.message_timestamp, g.players, g.channel, g.mode, [tuple(s) for s in g.stats])
+                    for g in h.games_in_channel(None)]
+        self.assertEqual(describe(a), describe(b))
+
+    def test_file_storage_reloads_snapshot_and_journal(self):
+        history = PS4History(set(["stat.scrub"]), storage = self.file_storage())
+        play(history, 40)
+        history.save()
+        play(history, 10, seed = 2) # journalled only
+        history.flush()
+        history.storage.close()
+
+        reloaded = PS4History(set(["stat.scrub"]), storage = self.file_storage())
+        self.assertSameHistory(reloaded, history)
+        reloaded.storage.close()
+
+    def test_sqlite_storage_matches_in_memory_stats(self):
+        memory = PS4History(set(["stat.scrub"]), load = False)
+        sqlite = PS4History(set(["stat.scrub"]), storage = self.sqlite_storage())
+        play(memory, 120)
+        play(sqlite, 120)
+
+        for channel in [None, "games", "fifa", "towerfall"]:
+            for year in [None, datetime.datetime(2016, 1, 1), datetime.datetime(2017, 1, 1)]:
+                self.assertEqual(stats_for(sqlite, channel, year), stats_for(memory, channel, year))
+        self.assertEqual(sqlite.user_ranking("fifa"), memory.user_ranking("fifa"))
+
+        sqlite.flush()
+        sqlite.storage.close()
+        reloaded = PS4History(set(["stat.scrub"]), storage = self.sqlite_storage())
+        self.assertSameHistory(reloaded, memory)
+        reloaded.storage.close()
+
+    def test_sqlite_history_reads_games_as_needed(self):
+        memory = PS4History(set(["stat.scrub"]), load = False)
+        play(memory, 120)
+        sqlite = PS4History(set(["stat.scrub"]), storage = self.sqlite_storage())
+        play(sqlite, 120)
+        sqlite.flush()
+        sqlite.storage.close()
+
+        reloaded = PS4History(set(["stat.scrub"]), storage = self.sqlite_storage())
+        self.assertEqual(reloaded.games, [])
+        for channel in ["games", "fifa", "towerfall"]:
+            for year in [None, datetime.datetime(2016, 1, 1)]:
+                self.assertEqual(elo_for(reloaded, channel, year), elo_for(memory, channel, year))
+        self.assertLessEqual(len(reloaded.cached_games), 120)
+
+        # changing an early game rolls the ratings back in both
+        game = memory.games_in_channel("fifa")[2]
+        for h in [memory, reloaded]:
+            h.register_stat(game.message_timestamp, game.players[0], game.players[0], False, "stat.win")
+        self.assertEqual(elo_for(reloaded, "fifa", None), elo_for(memory, "fifa", None))
+        self.assertNotEqual(elo_for(memory, "fifa", None), {})
+
+        game = memory.games[3]
+        found = reloaded.find_game(game.message_timestamp)
+        self.assertEqual((found.players, found.channel), (game.players, game.channel))
+        self.assertIsNone(reloaded.find_game("1.000000"))
+        reloaded.storage.close()
+
+    def test_sqlite_imports_the_file_history(self):
+        files = PS4History(set(["stat.scrub"]), storage = self.file_storage())
+        play(files, 40)
+        files.save()
+        play(files, 10, seed = 2) # journalled only
+        files.flush()
+        files.storage.close()
+
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name) # the default paths are relative
+        try:
+            imported = PS4History(set(["stat.scrub"]), storage = open_storage("sqlite"))
+            self.assertSameHistory(imported, files)
+            imported.storage.close()
+        finally:
+            os.chdir(cwd)
+
+if __name__ == '__main__':
+    unittest.main()
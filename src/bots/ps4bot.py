@@ -1,12 +1,13 @@
 from collections import defaultdict
 import datetime
+import heapq
+import itertools
+import os
 import random
 import sys
 import re
 import traceback
 
-from functional import find
-
 from .bot import Bot
 from msg.slackpostedmessage import SlackPostedMessage
 from .ps4.game import Game, GameStates, GameFull, PlayerAlreadyPresent
@@ -15,6 +16,8 @@ from .ps4.cfg import PLAY_TIME, GAME_FOLLOWON_TIME
 from .ps4.parsing import parse_time, deserialise_time, parse_game_initiation, \
         pretty_mode, parse_stats_request, date_with_year, empty_parameters, TooManyTimeSpecs
 from .ps4.history import PS4History, Keys
+from .ps4.banter import BanterStore
+from .ps4.gameindex import GameIndex
 from .ps4.gamecategory import vote_message, Stats, channel_statmap, suggest_teams, \
         gametype_from_channel, channel_has_scrub_stats, channel_is_foosball, \
         channel_is_football_tournament, channel_is_boardgame, \
@@ -24,6 +27,7 @@ from .ps4 import elo
 DIALECT = ["here", "hew", "areet"]
 BIG_GAME_REGEX = re.compile(".*(big|large|medium|huge|hueg|massive|medium|micro|mini|biggest|small) game.*", re.IGNORECASE)
 SAVE_FILE = "ps4-games.txt"
+SAVE_INTERVAL = 5 # seconds - saves within this long of each other are written once
 BANTER_FILE = "ps4-banter.txt"
 
 BANTER_DEFAULTS = {
@@ -43,7 +47,8 @@ class Usage:
     nar = "Cancel your game, optionally disambiguating with a time"
     games = "List games"
     scuttle = "Reschedule a game, optionally disambiguating with a time, e.g. `scuttle 3pm`, `scuttle 2pm to 3pm`"
-    stats = "Show stats, optionally for a given channel, and year, e.g. `stats 2019`, `stats towerfall 2018`"
+    stats = "Show stats, optionally for a given channel, and year, e.g. `stats 2019`, `stats towerfall 2018`, " \
+            + "or compare elo k-factors, e.g. `stats k=10..40`"
 
 class MultipleDescribedGamesFound(Exception):
     def __init__(self, search):
@@ -128,9 +133,19 @@ class PS4Bot(Bot):
 
         self.icon_emoji = ":video_game:"
         self.games = []
+        self.game_index = GameIndex() # self.games, by type and start time
         self.user_options = defaultdict(set) # name => set([flag1, flag2...])
         self.history = PS4History(negative_stats = set([Stats.scrub]), load=load)
         self.latest_stats_table = defaultdict(LatestStats) # channel => LatestStats
+        self.banter = BanterStore(BANTER_FILE, BANTER_DEFAULTS)
+        self.transitions = [] # heap of (deadline, seq, game)
+        self.transition_seq = itertools.count()
+        self.pending_transitions = dict() # game => seq of its live heap entry
+        self.wake_timer = None
+        self.wake_seq = None # seq of the heap entry wake_timer is for
+        self.dirty = False
+        self.save_timer = None
+        self.saves_coalesced = 0
         if load:
             self.load()
 
@@ -156,10 +171,14 @@ class PS4Bot(Bot):
 
                     if line[:6] == "stats ":
                         tokens = line.split(" ", 5)
+                        parameters = parse_parameters(tokens[4])
+                        if isinstance(parameters["h"], int) and parameters["h"] > elo.max_history_length:
+                            # saved before h was limited - summary_stats() would refuse it
+                            parameters["h"] = elo.max_history_length
                         self.latest_stats_table[tokens[1]] = LatestStats(
                                 tokens[2],
                                 date_with_year(int(tokens[3])) if tokens[3] != "-" else None,
-                                parse_parameters(tokens[4]))
+                                parameters)
                         continue
                     if line[:5] == "user ":
                         tokens = line.split()
@@ -227,8 +246,28 @@ class PS4Bot(Bot):
             pass
 
     def save(self):
+        """
+        Marks our state as changed, writing it out within SAVE_INTERVAL seconds
+        """
+        if self.dirty:
+            self.saves_coalesced += 1
+            return
+        self.dirty = True
+
+        self.save_timer = self.call_later(SAVE_INTERVAL, self.write_state)
+        if self.save_timer is None:
+            # not connected, nothing to write behind for us
+            self.write_state()
+
+    def write_state(self):
+        self.save_timer = None
+        if not self.dirty:
+            return
+        self.dirty = False
+
+        tmp = SAVE_FILE + ".tmp"
         try:
-            with open(SAVE_FILE, "w") as f:
+            with open(tmp, "w") as f:
                 for g in self.games:
                     print("{} {} {} {} {} {} {} {} {}".format(
                             when_str(g.when),
@@ -256,40 +295,21 @@ class PS4Bot(Bot):
                     if len(options):
                         print("user {} {}".format(user, " ".join(options)), file=f)
 
+            os.replace(tmp, SAVE_FILE)
         except IOError as e:
             print("exception saving state: {}".format(e), file=sys.stderr)
 
-        self.history.save()
+        self.history.flush()
 
 
     def game_occuring_at(self, when, gametype):
-        for game in self.games:
-            if game.type != gametype:
-                continue
-            if game.contains(when):
-                return game
-        return None
+        return self.game_index.occurring_at(when, gametype)
 
     def game_overlapping(self, when, play_time, gametype, ignoring = None):
-        when_end = when + datetime.timedelta(minutes = play_time)
-        for game in self.games:
-            if game == ignoring:
-                continue
-            if game.type != gametype:
-                continue
-            if game.contains(when) or game.contains(when_end, start_overlap = False):
-                return game
-        return None
+        return self.game_index.overlapping(when, play_time, gametype, ignoring)
 
     def game_straight_after(self, previous, threshold):
-        threshold_delta = datetime.timedelta(minutes = threshold)
-        for game in self.games:
-            if game.type != previous.type:
-                continue
-            endtime = previous.endtime()
-            if endtime <= game.when < endtime + threshold_delta:
-                return game
-        return None
+        return self.game_index.straight_after(previous, threshold)
 
     def games_created_by(self, user):
         return [g for g in self.games if g.creator == user]
@@ -305,23 +325,64 @@ class PS4Bot(Bot):
         ):
         g = Game(when, desc, channel, creator, msg, max_players, play_time, mode, state)
         self.games.append(g)
+        self.game_index.add(g)
+        self.register_message(msg.channel, msg.timestamp, g)
         self.history.add_game(g)
+        g.player_listener = self.game_player_changed
+        self.track_game_state(g)
         return g
 
-    def history_sync(self):
-        # push player updates to history
+    def track_game_state(self, game):
+        """
+        (Re)queue the game's next state transition, replacing any already queued
+        """
+        deadline = game.next_transition()
+        if deadline is None:
+            self.untrack_game_state(game)
+            return
 
-        updated = False
-        for g in self.games:
-            h = self.history.find_game(g.message.timestamp)
-            if not h:
-                continue
+        seq = next(self.transition_seq)
+        self.pending_transitions[game] = seq
+        heapq.heappush(self.transitions, (deadline, seq, game))
+        self.schedule_wake()
+
+    def untrack_game_state(self, game):
+        # its heap entry is dropped lazily, once it reaches the top
+        self.pending_transitions.pop(game, None)
+        self.schedule_wake()
+
+    def next_transition(self):
+        while len(self.transitions):
+            deadline, seq, game = self.transitions[0]
+            if self.pending_transitions.get(game) == seq:
+                return deadline
+            heapq.heappop(self.transitions)
+        return None
 
-            h.players = g.players[:]
-            updated = True
+    def schedule_wake(self):
+        """
+        Sleep until the next game transition, rather than waiting for the next timeout()
+        """
+        deadline = self.next_transition()
+        seq = self.transitions[0][1] if deadline is not None else None
+        if seq == self.wake_seq:
+            return
+
+        if self.wake_timer:
+            self.wake_timer.cancel()
+
+        def wake():
+            self.handle_imminent_games()
+            self.save()
 
-        if updated:
-            self.history.save()
+        self.wake_seq = seq
+        self.wake_timer = self.call_at(deadline, wake) if deadline is not None else None
+
+    def game_player_changed(self, game, player, removed):
+        if removed:
+            self.history.remove_player(game.message.timestamp, player)
+        else:
+            self.history.add_player(game.message.timestamp, player)
 
     def load_banter(self, type, replacements = {}, for_user = None, in_channel = None):
         """
@@ -330,59 +391,13 @@ class PS4Bot(Bot):
         for_champ = False
         if for_user:
             year = self.latest_stats_table[in_channel].year
-            user_ranking = self.history.user_ranking(in_channel, year = year)
-            try:
-                for_champ = user_ranking.index(for_user) < 3
-            except ValueError:
-                pass
+            for_champ = for_user in self.history.champions(in_channel, year = year)
 
         allow_controversial = channel_is_private(in_channel)
-        type_warned = []
-
-        try:
-            msgs = []
-            with open(BANTER_FILE, "r") as f:
-                while True:
-                    line = f.readline()
-                    if line == "":
-                        break
-                    line = line.rstrip("\n")
-                    if len(line) == 0 or line[0] == "#":
-                        continue
-                    tokens = line.split(":", 1)
-                    if len(tokens) != 2:
-                        print("invalid banter line %s" % line, file=sys.stderr)
-                        continue
 
-                    bant_type = tokens[0]
-
-                    is_controversial = bant_type.startswith("(controversial) ")
-                    if is_controversial:
-                        bant_type = bant_type[16:]
-                        if not allow_controversial:
-                            continue
-
-                    is_champ = bant_type.endswith("-champ")
-                    if is_champ:
-                        bant_type = bant_type[:-6]
-                        if not for_champ:
-                            continue
-
-                    if bant_type != type:
-                        if bant_type not in BANTER_DEFAULTS:
-                            if bant_type not in type_warned:
-                                print("unknown banter type \"%s\"" % bant_type, file=sys.stderr)
-                                type_warned.append(bant_type)
-                        continue
-                    msg = tokens[1].strip()
-                    msgs.append(msg)
-
-            if len(msgs):
-                r = random.randint(0, len(msgs) - 1)
-                return replace_dict(msgs[r], replacements)
-
-        except IOError as e:
-            print("exception loading banter: {}".format(e), file=sys.stderr)
+        msg = self.banter.pick(type, for_champ = for_champ, allow_controversial = allow_controversial)
+        if msg is not None:
+            return replace_dict(msg, replacements)
 
         if type in BANTER_DEFAULTS:
             return BANTER_DEFAULTS[type]
@@ -422,7 +437,7 @@ class PS4Bot(Bot):
                 in_channel = channel)
 
         message = Game.create_message(banter, desc, when, max_player_count, mode, channel)
-        posted_message = self.send_message(message)
+        posted_message = self.send_message(message).result()
 
         game = self.new_game(when, desc, channel, user, \
                 posted_message, max_player_count, play_time, mode)
@@ -481,15 +496,14 @@ class PS4Bot(Bot):
                 for_user = user,
                 in_channel = game.channel)
 
-        self.history_sync()
-
         if not subtle_message:
             self.send_message(banter)
         self.update_game_message(game, banter if subtle_message else None)
         self.save()
 
     def remove_user_from_game(self, user, game, subtle_message = False):
-        if game.remove_player(user):
+        removed = game.remove_player(user)
+        if removed:
             banter = ":candle: {}".format(format_user(user))
         else:
             if subtle_message:
@@ -501,12 +515,11 @@ class PS4Bot(Bot):
                     format_user(user),
                     game.description)
 
-        self.history_sync()
-
         if not subtle_message:
             self.send_message(banter)
         self.update_game_message(game, banter if subtle_message else None)
-        self.save()
+        if removed:
+            self.save()
 
     def send_game_not_found(self, when, user):
         if random.randint(0, 1) == 0:
@@ -574,6 +587,9 @@ class PS4Bot(Bot):
             return
 
         self.games = [g for g in self.games if g != game]
+        self.game_index.remove(game)
+        self.unregister_message(game.message.channel, game.message.timestamp, game)
+        self.untrack_game_state(game)
 
         rip_players = game.pretty_players(with_creator = False)
         rip_players_message = " (just burn some time on kimble instead {})".format(rip_players) \
@@ -692,6 +708,8 @@ class PS4Bot(Bot):
                 in_channel = game_to_move.channel)
 
         game_to_move.update_when(when_to, banter)
+        self.game_index.move(game_to_move)
+        self.track_game_state(game_to_move)
         self.update_game_message(game_to_move, "moved by {} to {}".format(
             format_user(message.user), when_str(when_to)))
 
@@ -844,7 +862,7 @@ class PS4Bot(Bot):
                     original_timestamp = self.latest_stats_table[channel].timestamp,
                     original_channel = channel)
         else:
-            table_msg = self.send_message(tables_message_str)
+            table_msg = self.send_message(tables_message_str).result()
 
         if table_msg and anchor_message:
             self.latest_stats_table[channel].timestamp = table_msg.timestamp
@@ -868,6 +886,15 @@ class PS4Bot(Bot):
         if not channel_name:
             channel_name = message.channel.name
 
+        if parameters["h"] is not None and parameters["h"] > elo.max_history_length:
+            self.send_message(":warning: ere {}: only the last {} games are kept, h={} at most".format(
+                format_user(message.user), elo.max_history_length, elo.max_history_length))
+            return
+
+        if parameters["k_sweep"]:
+            self.send_elo_sweep(channel_name, year, parameters["k_sweep"])
+            return
+
         try:
             stats = self.history.summary_stats(channel_name, year = year, parameters = parameters)
 
@@ -877,6 +904,38 @@ class PS4Bot(Bot):
         except OverflowError as e:
             self.send_message(":warning: overflow calculating elo stats, sort yerselves out")
 
+    def send_elo_sweep(self, channel, year, k_factors):
+        """
+        Compare elo leaderboards for several k-factors side by side
+        """
+        try:
+            batch = self.history.elo_sweep(channel, year, k_factors)
+        except OverflowError as e:
+            self.send_message(":warning: overflow calculating elo stats, sort yerselves out")
+            return
+
+        columns = sorted(batch.rankings)
+        if len(batch.games_played) == 0:
+            self.send_message(":warning: no stats for \"{}\"".format(channel))
+            return
+
+        def ranking(user, column):
+            r = batch.rankings[column][user]
+            return r if batch.games_played[user] > elo.minimum_games_played else "{}?".format(r)
+
+        def row_for_user(user):
+            if UserOption.mute in self.user_options[user]:
+                user_cell = (0, user)
+            else:
+                user_cell = (format_user_padding(user) - 2, format_user(user))
+            return [user_cell] + [ranking(user, column) for column in columns]
+
+        # order by the first k-factor
+        users = sorted(batch.games_played, key = lambda u: batch.rankings[columns[0]][u], reverse = True)
+        header = ["Player"] + ["k={}".format(k) for k, _ in columns]
+
+        self.send_message(generate_table(header, [row_for_user(u) for u in users]))
+
     def handle_command(self, message, command, rest):
         if len(command.strip()) == 0 and len(rest) == 0:
             self.send_dialect_reply(message)
@@ -901,33 +960,42 @@ class PS4Bot(Bot):
             ))
 
     def update_game_states(self):
+        """
+        Moves each game whose transition deadline has passed on by one state,
+        returning those games
+        """
         now = datetime.datetime.today()
-        fiveminutes = datetime.timedelta(minutes = 5)
-        twelvehours = datetime.timedelta(hours = 12)
-
-        for g in self.games:
-            if g.state == GameStates.scheduled:
-                if now > g.when - fiveminutes:
-                    g.state = GameStates.active
-            elif g.state == GameStates.active:
-                if now > g.endtime():
-                    g.state = GameStates.finished
-            elif g.state == GameStates.finished:
-                timestamp_date = datetime.datetime.fromtimestamp(float(g.message.timestamp))
-                if now - timestamp_date > twelvehours:
-                    g.state = GameStates.dead
 
-    def handle_imminent_games(self):
-        scheduled_games = [g for g in self.games if g.state == GameStates.scheduled]
-        active_games = [g for g in self.games if g.state == GameStates.active]
+        advanced = []
+        while True:
+            deadline = self.next_transition()
+            if deadline is None or not deadline < now:
+                break
+
+            _, _, game = heapq.heappop(self.transitions)
+            del self.pending_transitions[game]
+            game.advance_state()
+            advanced.append(game)
+
+        # requeue afterwards, so a game moves at most one state per call
+        for game in advanced:
+            self.track_game_state(game)
 
-        self.update_game_states()
+        return advanced
+
+    def handle_imminent_games(self):
+        advanced = self.update_game_states()
 
         # keep games until end-of-day (to allow late entrants, etc)
-        self.games = [g for g in self.games if g.state != GameStates.dead]
+        dead = [g for g in advanced if g.state == GameStates.dead]
+        if len(dead):
+            self.games = [g for g in self.games if g.state != GameStates.dead]
+            for g in dead:
+                self.game_index.remove(g)
+                self.unregister_message(g.message.channel, g.message.timestamp, g)
 
-        imminent_games = [g for g in scheduled_games if g.state == GameStates.active]
-        just_finished_games = [g for g in active_games if g.state == GameStates.finished]
+        imminent_games = [g for g in advanced if g.state == GameStates.active]
+        just_finished_games = [g for g in advanced if g.state == GameStates.finished]
 
         for g in imminent_games:
             if len(g.players) == 0:
@@ -963,7 +1031,11 @@ class PS4Bot(Bot):
                 self.update_game_message(g, msg)
 
     def teardown(self):
-        self.save()
+        if self.save_timer:
+            self.save_timer.cancel()
+        self.dirty = True
+        self.write_state()
+        self.history.save()
 
     def timeout(self):
         self.handle_imminent_games()
@@ -1068,9 +1140,10 @@ class PS4Bot(Bot):
     def handle_reaction(self, reaction, removed = False):
         emoji = reaction.emoji
         msg_when = reaction.original_msg_time
-        reacting_user = self.lookup_user(reaction.reacting_user)
+        reacting_user = self.user_id(reaction.reacting_user)
 
-        game = find(lambda g: g.message.timestamp == msg_when, self.games)
+        # not registered_reactions_only - stats are voted for on past games' messages too
+        game = self.message_owner(reaction.channel["id"], msg_when)
         if game:
             self.handle_game_reaction(game, reacting_user, emoji, removed)
 
@@ -1097,8 +1170,8 @@ class PS4Bot(Bot):
             return
 
         try:
-            # lookup message.user
-            message.user = self.lookup_user(message.user)
+            # players (and their stats) are kept by id, format_user() mentions them
+            message.user = self.user_id(message.user)
 
             # ignore leading dialect bits, e.g. "ps4bot here hew big game" --> "ps4bot big game"
             while len(tokens) > 1 and tokens[1] in DIALECT:
@@ -27,6 +27,8 @@ def n_to_day(n):
     return day.strftime("%A")
 
 class SportBot(Bot):
+    registered_reactions_only = True
+
     def __init__(self, slackconnection, botname):
         Bot.__init__(self, slackconnection, botname)
         self.icon_emoji = ':tennis:'
@@ -41,6 +43,8 @@ class SportBot(Bot):
             return
 
         self.games = [Game.from_json(j) for j in state["games"]]
+        for g in self.games:
+            self.register_message(g.message_channel, g.message_timestamp, g)
 
     def save(self):
         try:
@@ -61,7 +65,7 @@ class SportBot(Bot):
         self.send_message("EH?!? What you on about <@{}>?".format(to_user))
 
     def handle_message(self, message):
-        user = self.lookup_user(message.user)
+        user = self.user_id(message.user)
         text = message.text.lower()
 
         start = f"{self.botname} "
@@ -86,27 +90,23 @@ class SportBot(Bot):
 
             g = Game(monday, None)
             msg_str = message_for_game(g)
-            posted_msg = self.send_message(msg_str)
+            posted_msg = self.send_message(msg_str).result()
 
             g.message_timestamp = posted_msg.timestamp
+            g.message_channel = posted_msg.channel
             self.games.append(g)
+            self.register_message(g.message_channel, g.message_timestamp, g)
             self.save()
             return
 
         self.send_short_usage(to_user=user)
 
     def handle_reaction(self, reaction: SlackReaction, removed=False):
-        candidates = [g for g in self.games if g.message_timestamp == reaction.original_msg_time]
-
-        if len(candidates) == 0:
-            #print(f"no candidates found for {reaction}")
-            return
-
-        if len(candidates) > 1:
-            print(f"internal error: multiple games on same msg timestamp {reaction.original_msg_time}", file=sys.stderr)
+        game = self.message_owner(reaction.channel["id"], reaction.original_msg_time)
+        if game is None:
+            #print(f"no game found for {reaction}")
             return
 
-        game = candidates[0]
         if not game.update_user_via_emoji(reaction.reacting_user, reaction.emoji, removed):
             return
 
@@ -122,9 +122,10 @@ class SportBot(Bot):
         self.handle_reaction(reaction, removed=True)
 
 class Game:
-    def __init__(self, when, message_timestamp, day_to_players=None):
+    def __init__(self, when, message_timestamp, day_to_players=None, message_channel=None):
         self.when = when
         self.message_timestamp = message_timestamp
+        self.message_channel = message_channel # channel id, None for games saved before we kept it
         self.day_to_players = day_to_players if day_to_players is not None else defaultdict(list)
 
     def __repr__(self):
@@ -138,6 +139,7 @@ class Game:
                 str(k): v for k, v in self.day_to_players.items() if len(v)
             },
             "message_timestamp": self.message_timestamp,
+            "message_channel": self.message_channel,
         }
 
     @staticmethod
@@ -146,6 +148,7 @@ class Game:
             datetime.strptime(j["when"], DATE_FMT_INTERNAL),
             j["message_timestamp"],
             defaultdict(list, { int(k): v for k, v in j["day_to_players"].items() }),
+            j.get("message_channel"),
         )
 
     def update_user_via_emoji(self, user, emoji, removed):
@@ -0,0 +1,202 @@
+import json
+import sys
+import threading
+import time
+import zlib
+
+from slack.errors import SlackApiError
+
+from channelregistry import ChannelRegistry
+
+CHANNELS_FILE = "channels-cache.json"
+CHANNELS_FILE_VERSION = 1
+CHANNEL_TTL = 24 * 60 * 60 # seconds
+TTL_SPREAD = 0.25 # entries go stale up to this fraction of the ttl early, so ones fetched together don't all expire together
+MISS_TTL = 10 * 60 # seconds, before asking again about an id slack couldn't tell us about
+SAVE_INTERVAL = 30 # seconds - changes within this long of each other are written once
+
+def compact_channel(channel):
+    # we only ever read the id and name, don't hold onto (or save) the rest
+    return { "id": channel["id"], "name": channel.get("name") }
+
+class ChannelCache():
+    """
+    Channels, backed by CHANNELS_FILE and refreshed from slack one channel at a time
+
+    Each entry is stamped with when we last heard about it from slack. Lookups of
+    unknown or stale ids go to conversations_info, rather than re-listing every channel.
+
+    With a scheduler, changes are written out behind, on its thread, so
+    everything touching the registry holds self.lock.
+    """
+    def __init__(self, webclient, ttl = CHANNEL_TTL, scheduler = None):
+        self.webclient = webclient
+        self.ttl = ttl
+        self.scheduler = scheduler
+        self.lock = threading.RLock()
+        self.save_timer = None
+        self.registry = None
+        self.fetched_at = dict() # id => time
+        self.misses = dict() # id => when slack last couldn't tell us about it
+
+    def __len__(self):
+        return len(self._ensure_loaded())
+
+    def _ensure_loaded(self):
+        if self.registry is None:
+            try:
+                self.load()
+            except FileNotFoundError:
+                self.load_api()
+                self.write()
+        return self.registry
+
+    def load(self):
+        with open(CHANNELS_FILE, "r") as f:
+            cached = json.load(f)
+
+        self.registry = ChannelRegistry()
+        self.fetched_at = dict()
+
+        if isinstance(cached, list):
+            # old format: the full channel objects, with no timestamps - treat as stale
+            for channel in cached:
+                self._store(compact_channel(channel), 0)
+            return
+
+        if cached.get("version") != CHANNELS_FILE_VERSION:
+            print("unknown {} version {}, ignoring".format(CHANNELS_FILE, cached.get("version")), file=sys.stderr)
+            return
+
+        for id, name, fetched_at in cached["channels"]:
+            self._store({ "id": id, "name": name }, fetched_at)
+
+    def load_api(self):
+        print("fetching channels...")
+        self.registry = ChannelRegistry()
+        self.fetched_at = dict()
+        args = {
+            "types": "public_channel,private_channel",
+        }
+
+        while True:
+            while True:
+                try:
+                    response = self.webclient.conversations_list(**args)
+                    break
+                except SlackApiError as e:
+                    print(f'sleeping (error - {e})')
+                    time.sleep(60)
+
+            now = time.time()
+            for channel in response.get('channels', []):
+                self._store(compact_channel(channel), now)
+
+            next_cursor = response.get('response_metadata', {}).get('next_cursor')
+            if not next_cursor:
+                break
+            args["cursor"] = next_cursor
+
+        print("fetched channels")
+
+    def save(self):
+        """
+        Marks the cache as changed, writing it out within SAVE_INTERVAL seconds
+        (or straight away, without a scheduler)
+        """
+        with self.lock:
+            if self.save_timer is not None:
+                return
+            if self.scheduler is not None:
+                self.save_timer = self.scheduler.call_later(SAVE_INTERVAL, self.write)
+                return
+        self.write()
+
+    def flush(self):
+        """
+        Writes out any changes save() is holding
+        """
+        with self.lock:
+            if self.save_timer is None:
+                return
+            self.save_timer.cancel()
+        self.write()
+
+    def write(self):
+        with self.lock:
+            self.save_timer = None
+            if self.registry is None:
+                return
+            channels = [
+                [c["id"], c["name"], self.fetched_at.get(c["id"], 0)]
+                for c in self.registry
+            ]
+        try:
+            with open(CHANNELS_FILE, "w") as f:
+                json.dump({ "version": CHANNELS_FILE_VERSION, "channels": channels }, f, separators=(",", ":"))
+        except IOError as e:
+            print("exception saving channels: {}".format(e), file=sys.stderr)
+
+    def _store(self, channel, fetched_at):
+        with self.lock:
+            self.registry.add(channel)
+            self.fetched_at[channel["id"]] = fetched_at
+            self.misses.pop(channel["id"], None)
+
+    def _ttl_for(self, channel_id):
+        spread = (zlib.crc32(channel_id.encode("utf-8")) % 1000) / 1000
+        return self.ttl * (1 - TTL_SPREAD * spread)
+
+    def fetch(self, channel_id):
+        try:
+            response = self.webclient.conversations_info(channel = channel_id)
+        except SlackApiError as e:
+            print("couldn't fetch channel {}: {}".format(channel_id, e), file=sys.stderr)
+            return None
+
+        channel = response.get("channel")
+        if not channel:
+            return None
+        return compact_channel(channel)
+
+    def lookup(self, channel_id):
+        registry = self._ensure_loaded()
+        now = time.time()
+
+        channel = registry.lookup(channel_id)
+        if channel is not None and now - self.fetched_at.get(channel_id, 0) < self._ttl_for(channel_id):
+            return channel
+        if now - self.misses.get(channel_id, 0) < MISS_TTL:
+            # slack couldn't tell us just now, don't hold up every event asking again
+            return channel
+
+        fetched = self.fetch(channel_id)
+        if fetched is None:
+            self.misses[channel_id] = now
+            # a stale entry is better than nothing
+            return channel
+
+        self._store(fetched, now)
+        self.save()
+        return registry.lookup(channel_id)
+
+    def add(self, channel):
+        self._ensure_loaded()
+        self._store(compact_channel(channel), time.time())
+        self.save()
+
+    def rename(self, channel_id, name):
+        registry = self._ensure_loaded()
+        with self.lock:
+            if registry.rename(channel_id, name) is None:
+                self._store({ "id": channel_id, "name": name }, time.time())
+            else:
+                self.fetched_at[channel_id] = time.time()
+        self.save()
+
+    def remove(self, channel_id):
+        registry = self._ensure_loaded()
+        with self.lock:
+            registry.remove(channel_id)
+            self.fetched_at.pop(channel_id, None)
+        self.save()
@@ -0,0 +1,153 @@
+import unittest
+import json
+import os
+import tempfile
+import time
+
+from slack.errors import SlackApiError
+
+from channelcache import ChannelCache, CHANNELS_FILE, MISS_TTL, SAVE_INTERVAL, TTL_SPREAD
+
+class FakeWebClient():
+    def __init__(self, channels):
+        self.channels = { c["id"]: c for c in channels }
+        self.calls = []
+
+    def conversations_list(self, **args):
+        self.calls.append("conversations_list")
+        return { "channels": list(self.channels.values()) }
+
+    def conversations_info(self, channel):
+        self.calls.append(("conversations_info", channel))
+        if channel not in self.channels:
+            raise SlackApiError("channel_not_found", { "ok": False })
+        return { "channel": self.channels[channel] }
+
+class FakeTimer():
+    def __init__(self, delay, fn):
+        self.delay = delay
+        self.fn = fn
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class FakeScheduler():
+    def __init__(self):
+        self.timers = []
+
+    def call_later(self, delay, fn):
+        timer = FakeTimer(delay, fn)
+        self.timers.append(timer)
+        return timer
+
+class TestChannelCache(unittest.TestCase):
+    def setUp(self):
+        # CHANNELS_FILE is relative
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.webclient = FakeWebClient([
+            { "id": "C1", "name": "games", "topic": "not kept" },
+            { "id": "C2", "name": "fifa" },
+        ])
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_lists_once_then_serves_from_cache(self):
+        cache = ChannelCache(self.webclient)
+        self.assertEqual(cache.lookup("C1"), { "id": "C1", "name": "games" })
+        self.assertEqual(cache.lookup("C2")["name"], "fifa")
+        self.assertEqual(self.webclient.calls, ["conversations_list"])
+
+        # persisted - a new cache doesn't go back to slack
+        reloaded = ChannelCache(self.webclient)
+        self.assertEqual(reloaded.lookup("C1")["name"], "games")
+        self.assertEqual(self.webclient.calls, ["conversations_list"])
+
+    def test_stale_entries_are_refetched(self):
+        cache = ChannelCache(self.webclient, ttl = 60)
+        cache.lookup("C1")
+        cache.fetched_at["C1"] = time.time() - 120
+
+        self.webclient.channels["C1"]["name"] = "games-renamed"
+        self.assertEqual(cache.lookup("C1")["name"], "games-renamed")
+        self.assertEqual(self.webclient.calls[-1], ("conversations_info", "C1"))
+
+        # and once it's fresh, no more fetches
+        calls = len(self.webclient.calls)
+        cache.lookup("C1")
+        self.assertEqual(len(self.webclient.calls), calls)
+
+        # slack can't tell us - the stale entry is better than nothing
+        cache.fetched_at["C1"] = time.time() - 120
+        del self.webclient.channels["C1"]
+        self.assertEqual(cache.lookup("C1")["name"], "games-renamed")
+
+    def test_failed_refreshes_are_remembered(self):
+        cache = ChannelCache(self.webclient, ttl = 60)
+        cache.lookup("C1")
+        cache.fetched_at["C1"] = time.time() - 120
+        del self.webclient.channels["C1"]
+
+        for _ in range(3):
+            self.assertEqual(cache.lookup("C1")["name"], "games")
+        self.assertEqual(self.webclient.calls.count(("conversations_info", "C1")), 1)
+
+        # until the miss expires
+        cache.misses["C1"] = time.time() - MISS_TTL
+        cache.lookup("C1")
+        self.assertEqual(self.webclient.calls.count(("conversations_info", "C1")), 2)
+
+    def test_entries_fetched_together_go_stale_apart(self):
+        self.webclient.channels = { "C{}".format(i): { "id": "C{}".format(i), "name": str(i) } for i in range(50) }
+        cache = ChannelCache(self.webclient, ttl = 1000)
+        cache.lookup("C0")
+
+        ttls = [cache._ttl_for(id) for id in self.webclient.channels]
+        self.assertGreater(len(set(ttls)), 40)
+        self.assertTrue(all(1000 * (1 - TTL_SPREAD) <= ttl <= 1000 for ttl in ttls))
+
+    def test_saves_are_written_behind(self):
+        scheduler = FakeScheduler()
+        cache = ChannelCache(self.webclient, ttl = 60, scheduler = scheduler)
+        cache.lookup("C1") # lists and writes everything straight away
+
+        cache.add({ "id": "C3", "name": "towerfall" })
+        cache.rename("C2", "fifa-2")
+        cache.fetched_at["C1"] = time.time() - 120
+        cache.lookup("C1")
+        self.assertEqual(len(scheduler.timers), 1)
+        self.assertEqual(scheduler.timers[0].delay, SAVE_INTERVAL)
+        self.assertIsNone(ChannelCache(self.webclient).lookup("C3"))
+
+        scheduler.timers[0].fn()
+        self.assertEqual(ChannelCache(self.webclient).lookup("C3")["name"], "towerfall")
+
+        # a held save is written on flush
+        cache.remove("C3")
+        cache.flush()
+        self.assertTrue(scheduler.timers[1].cancelled)
+        self.assertIsNone(ChannelCache(self.webclient).lookup("C3"))
+
+    def test_misses_are_remembered(self):
+        cache = ChannelCache(self.webclient)
+        self.assertIsNone(cache.lookup("C9"))
+        self.assertIsNone(cache.lookup("C9"))
+        self.assertEqual(self.webclient.calls.count(("conversations_info", "C9")), 1)
+
+        cache.add({ "id": "C9", "name": "towerfall" })
+        self.assertEqual(cache.lookup("C9")["name"], "towerfall")
+
+    def test_old_format_is_loaded_as_stale(self):
+        with open(CHANNELS_FILE, "w") as f:
+            json.dump([{ "id": "C1", "name": "games", "members": ["U1"] }], f)
+
+        cache = ChannelCache(self.webclient)
+        self.assertEqual(cache.lookup("C1")["name"], "games")
+        self.assertEqual(self.webclient.calls, [("conversations_info", "C1")])
+
+if __name__ == '__main__':
+    unittest.main()
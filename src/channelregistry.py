@@ -0,0 +1,55 @@
+class ChannelRegistry():
+    """
+    Holds every channel we know about, indexed by id and by name
+    """
+    def __init__(self, channels = []):
+        self.by_id = dict()
+        self.by_name = dict()
+        for channel in channels:
+            self.add(channel)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __iter__(self):
+        return iter(self.by_id.values())
+
+    def add(self, channel):
+        old = self.by_id.get(channel["id"])
+        if old is not None:
+            self._unindex_name(old)
+
+        self.by_id[channel["id"]] = channel
+        name = channel.get("name")
+        if name is not None:
+            self.by_name[name] = channel
+
+    def remove(self, channel_id):
+        channel = self.by_id.pop(channel_id, None)
+        if channel is not None:
+            self._unindex_name(channel)
+        return channel
+
+    def rename(self, channel_id, name):
+        channel = self.by_id.get(channel_id)
+        if channel is None:
+            return None
+
+        self._unindex_name(channel)
+        channel["name"] = name
+        self.by_name[name] = channel
+        return channel
+
+    def lookup(self, channel_id):
+        return self.by_id.get(channel_id)
+
+    def lookup_name(self, name):
+        return self.by_name.get(name)
+
+    def to_list(self):
+        return list(self.by_id.values())
+
+    def _unindex_name(self, channel):
+        name = channel.get("name")
+        if name is not None and self.by_name.get(name) is channel:
+            del self.by_name[name]
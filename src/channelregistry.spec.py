@@ -0,0 +1,33 @@
+import unittest
+
+from channelregistry import ChannelRegistry
+
+class TestChannelRegistry(unittest.TestCase):
+    def test_lookup_by_id_and_name(self):
+        registry = ChannelRegistry([
+            { "id": "C1", "name": "games" },
+            { "id": "C2", "name": "fifa" },
+        ])
+
+        self.assertEqual(len(registry), 2)
+        self.assertEqual(registry.lookup("C2")["name"], "fifa")
+        self.assertEqual(registry.lookup_name("games")["id"], "C1")
+        self.assertIsNone(registry.lookup("C3"))
+
+    def test_incremental_updates(self):
+        registry = ChannelRegistry([{ "id": "C1", "name": "games" }])
+
+        registry.add({ "id": "C2", "name": "towerfall" })
+        self.assertEqual(registry.lookup_name("towerfall")["id"], "C2")
+
+        registry.rename("C1", "games-old")
+        self.assertIsNone(registry.lookup_name("games"))
+        self.assertEqual(registry.lookup("C1")["name"], "games-old")
+
+        registry.remove("C2")
+        self.assertIsNone(registry.lookup("C2"))
+        self.assertIsNone(registry.lookup_name("towerfall"))
+        self.assertEqual(len(registry), 1)
+
+if __name__ == '__main__':
+    unittest.main()
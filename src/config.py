@@ -0,0 +1,4 @@
+slack_token = "invalid"
+user_renames = {}
+channel_max_players = {}
+private_channels = []
@@ -0,0 +1,106 @@
+import queue
+import sys
+import threading
+import time
+
+HANDLER_TIMEOUT = 30 # seconds
+STOP_TIMEOUT = 10 # seconds
+REPORT_INTERVAL = 5 # seconds between report()s
+QUEUE_WARN_DEPTH = 10 # events waiting on a bot before report() mentions it
+
+class BotWorker():
+    def __init__(self, bot):
+        self.bot = bot
+        self.queue = queue.Queue()
+        self.started = None # when the running handler began, None if idle
+        self.warned = False
+        self.thread = threading.Thread(
+                target = self._run,
+                name = "bot-{}".format(bot.botname),
+                daemon = True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            fn = self.queue.get()
+            if fn is None:
+                return
+
+            self.started = time.monotonic()
+            self.warned = False
+            try:
+                fn()
+            finally:
+                self.started = None
+                self.queue.task_done()
+
+class Dispatcher():
+    """
+    Runs each bot's handlers on that bot's own thread
+
+    A bot sees its events one at a time and in order, but a bot that's busy
+    (sleeping on IO, waiting on a subprocess) only delays itself.
+    """
+    def __init__(self, timeout = HANDLER_TIMEOUT):
+        self.timeout = timeout
+        self.workers = dict() # bot => BotWorker
+        self.lock = threading.Lock()
+
+    def dispatch(self, bot, fn):
+        with self.lock:
+            worker = self.workers.get(bot)
+            if worker is None:
+                worker = self.workers[bot] = BotWorker(bot)
+        worker.queue.put(fn)
+        self.check_timeouts()
+
+    def queue_depths(self):
+        """
+        bot name => handlers queued (including any running)
+        """
+        with self.lock:
+            workers = list(self.workers.values())
+        return { w.bot.botname: w.queue.unfinished_tasks for w in workers }
+
+    def check_timeouts(self):
+        now = time.monotonic()
+        with self.lock:
+            workers = list(self.workers.values())
+
+        for worker in workers:
+            started = worker.started
+            if started is None or worker.warned or now - started < self.timeout:
+                continue
+            worker.warned = True
+            print("\7handler for \"{}\" running for {}s, {} event(s) queued behind it".format(
+                worker.bot.botname,
+                int(now - started),
+                worker.queue.qsize()), file=sys.stderr)
+
+    def report(self):
+        """
+        Warns about handlers running too long and bots with events backing up,
+        run every REPORT_INTERVAL so neither waits on the next dispatch
+        """
+        self.check_timeouts()
+
+        backed_up = sorted((name, depth) for name, depth in self.queue_depths().items()
+                if depth >= QUEUE_WARN_DEPTH)
+        if len(backed_up):
+            print("\7events backing up: {}".format(
+                ", ".join("{} has {} queued".format(name, depth) for name, depth in backed_up)), file=sys.stderr)
+
+    def stop(self, timeout = STOP_TIMEOUT):
+        """
+        Lets queued handlers finish, waiting at most timeout seconds in total
+        """
+        with self.lock:
+            workers = list(self.workers.values())
+            self.workers = dict()
+
+        for worker in workers:
+            worker.queue.put(None)
+
+        deadline = time.monotonic() + timeout
+        for worker in workers:
+            worker.thread.join(max(0, deadline - time.monotonic()))
@@ -0,0 +1,69 @@
+import unittest
+import contextlib
+import io
+import threading
+
+from dispatcher import Dispatcher, QUEUE_WARN_DEPTH
+
+class DummyBot:
+    def __init__(self, botname):
+        self.botname = botname
+
+class TestDispatcher(unittest.TestCase):
+    def test_slow_bot_doesnt_block_others(self):
+        dispatcher = Dispatcher()
+        slow, fast = DummyBot("slow"), DummyBot("fast")
+
+        release = threading.Event()
+        fast_done = threading.Event()
+        seen = []
+
+        dispatcher.dispatch(slow, lambda: release.wait(5))
+        dispatcher.dispatch(slow, lambda: seen.append("slow"))
+        dispatcher.dispatch(fast, fast_done.set)
+
+        self.assertTrue(fast_done.wait(5))
+        self.assertEqual(seen, [])
+        self.assertEqual(dispatcher.queue_depths()["slow"], 2)
+
+        release.set()
+        dispatcher.stop()
+        self.assertEqual(seen, ["slow"])
+
+    def test_bot_handlers_run_in_order(self):
+        dispatcher = Dispatcher()
+        bot = DummyBot("bot")
+        seen = []
+
+        for i in range(20):
+            dispatcher.dispatch(bot, lambda i=i: seen.append(i))
+        dispatcher.stop()
+
+        self.assertEqual(seen, list(range(20)))
+
+    def test_report_names_stuck_and_backed_up_bots(self):
+        dispatcher = Dispatcher()
+        stuck, idle = DummyBot("stuck"), DummyBot("idle")
+
+        release = threading.Event()
+        running = threading.Event()
+        dispatcher.dispatch(stuck, lambda: running.set() or release.wait(5))
+        for _ in range(QUEUE_WARN_DEPTH):
+            dispatcher.dispatch(stuck, lambda: None)
+        dispatcher.dispatch(idle, lambda: None)
+        self.assertTrue(running.wait(5))
+
+        dispatcher.timeout = 0 # it's been running long enough now
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            dispatcher.report()
+        release.set()
+        dispatcher.stop()
+
+        report = stderr.getvalue()
+        self.assertIn("handler for \"stuck\" running", report)
+        self.assertIn("stuck has {} queued".format(QUEUE_WARN_DEPTH + 1), report)
+        self.assertNotIn("idle", report)
+
+if __name__ == '__main__':
+    unittest.main()
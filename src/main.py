@@ -46,7 +46,8 @@ socketclient = RTMClient(token=BOT_TOKEN)
 webclient = WebClient(token=BOT_TOKEN)
 
 # setup channel monitoring
-slackmonitor = SlackMonitor(socketclient, webclient)
+slackmonitor = SlackMonitor(socketclient, webclient,
+        concurrent = getattr(config, "concurrent_handlers", False))
 
 for bot_name in sys.argv[sep + 1:]:
     alias = bot_name
@@ -0,0 +1,178 @@
+from concurrent.futures import Future
+import queue
+import sys
+import threading
+import time
+
+from slack.errors import SlackApiError
+
+MAX_RETRIES = 5
+STOP_TIMEOUT = 10 # seconds
+UPDATE_DEBOUNCE = 1 # seconds an update waits for newer edits of the same message
+
+# slack's published limits: posting is ~1/sec per channel (with short bursts),
+# chat.update is tier 3 (50+/min) across the workspace
+POST_RATE, POST_BURST = 1, 3
+UPDATE_RATE, UPDATE_BURST = 50 / 60, 5
+
+class TokenBucket():
+    def __init__(self, rate, burst):
+        self.rate = rate # tokens per second
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class OutboundJob():
+    def __init__(self, method, args, bucket, on_response):
+        self.method = method
+        self.args = args
+        self.bucket = bucket
+        self.on_response = on_response
+        self.future = Future()
+
+class OutboundQueue():
+    """
+    Delivers web API calls off the event thread
+
+    Each channel gets a worker thread draining its own queue, so messages to a
+    channel go out in the order they were sent, while a slow channel (or slack
+    rate limiting us) doesn't hold up any other.
+
+    Updates to a message are held back for UPDATE_DEBOUNCE on the scheduler,
+    outside the channel's queue, and any further updates to it in that window
+    just replace the text that'll be sent.
+    """
+    def __init__(self, webclient, scheduler):
+        self.webclient = webclient
+        self.scheduler = scheduler
+        self.workers = dict() # channel id => (thread, queue)
+        self.post_buckets = dict() # channel id => TokenBucket
+        self.update_bucket = TokenBucket(UPDATE_RATE, UPDATE_BURST)
+        self.pending_updates = dict() # (channel id, ts) => (OutboundJob, Timer)
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def post_message(self, on_response, **args):
+        channel = args["channel"]
+        with self.lock:
+            bucket = self.post_buckets.get(channel)
+            if bucket is None:
+                bucket = self.post_buckets[channel] = TokenBucket(POST_RATE, POST_BURST)
+        return self.submit(OutboundJob("chat_postMessage", args, bucket, on_response))
+
+    def update_message(self, on_response, **args):
+        key = (args["channel"], args["ts"])
+        with self.lock:
+            pending = self.pending_updates.get(key)
+            if pending is not None:
+                job, _ = pending
+                job.args = args
+                self.coalesced += 1
+                return job.future
+
+            job = OutboundJob("chat_update", args, self.update_bucket, on_response)
+            timer = self.scheduler.call_later(UPDATE_DEBOUNCE, lambda: self._release_update(key))
+            self.pending_updates[key] = (job, timer)
+        return job.future
+
+    def _release_update(self, key):
+        with self.lock:
+            # from here on, updates to this message are held afresh
+            pending = self.pending_updates.pop(key, None)
+        if pending is not None: # else stop() already sent it
+            self.submit(pending[0])
+
+    def submit(self, job):
+        self._queue_for(job.args["channel"]).put(job)
+        return job.future
+
+    def _queue_for(self, channel):
+        with self.lock:
+            worker = self.workers.get(channel)
+            if worker is None:
+                q = queue.Queue()
+                thread = threading.Thread(
+                        target = self._run,
+                        args = (q,),
+                        name = "outbound-{}".format(channel),
+                        daemon = True)
+                worker = self.workers[channel] = (thread, q)
+                thread.start()
+            return worker[1]
+
+    def _run(self, q):
+        while True:
+            job = q.get()
+            if job is None:
+                return
+            try:
+                self._deliver(job)
+            finally:
+                q.task_done()
+
+    def _deliver(self, job):
+        retries = MAX_RETRIES
+
+        while True:
+            job.bucket.take()
+            try:
+                response = getattr(self.webclient, job.method)(**job.args)
+                break
+            except SlackApiError as e:
+                if e.response.status_code != 429 or retries == 0:
+                    print("\7{} to {} failed: {}".format(job.method, job.args["channel"], e), file=sys.stderr)
+                    job.future.set_exception(e)
+                    return
+
+                retry_after = int(e.response.headers.get("Retry-After", 1))
+                print("rate limited on {}, retrying in {}s".format(job.method, retry_after), file=sys.stderr)
+                time.sleep(retry_after)
+                retries -= 1
+            except Exception as e:
+                print("\7{} to {} failed: {}".format(job.method, job.args["channel"], e), file=sys.stderr)
+                job.future.set_exception(e)
+                return
+
+        try:
+            result = job.on_response(response)
+        except Exception as e:
+            print("\7handling {} to {} failed: {}".format(job.method, job.args["channel"], e), file=sys.stderr)
+            job.future.set_exception(e)
+            return
+        job.future.set_result(result)
+
+    def stop(self, timeout = STOP_TIMEOUT):
+        """
+        Lets anything already queued go out, waiting at most timeout seconds in total
+        """
+        with self.lock:
+            held = list(self.pending_updates.values())
+            self.pending_updates = dict()
+        for job, timer in held:
+            timer.cancel()
+            self.submit(job)
+
+        with self.lock:
+            workers = list(self.workers.values())
+            self.workers = dict()
+
+        for _, q in workers:
+            q.put(None)
+
+        deadline = time.monotonic() + timeout
+        for thread, _ in workers:
+            thread.join(max(0, deadline - time.monotonic()))
@@ -0,0 +1,133 @@
+import unittest
+import threading
+import time
+
+from slack.errors import SlackApiError
+
+from outbound import OutboundQueue, TokenBucket, UPDATE_DEBOUNCE
+from scheduler import Scheduler
+
+class FakeResponse():
+    def __init__(self, status_code, headers = {}):
+        self.status_code = status_code
+        self.headers = headers
+
+class FakeWebClient():
+    def __init__(self):
+        self.posted = [] # (channel, text, time)
+        self.updated = [] # (channel, ts, text, time)
+        self.failures = [] # responses to raise, in turn
+        self.lock = threading.Lock()
+        self.ts = 0
+
+    def chat_postMessage(self, channel, text, **rest):
+        with self.lock:
+            if len(self.failures):
+                raise SlackApiError("failed", self.failures.pop(0))
+            self.ts += 1
+            self.posted.append((channel, text, time.monotonic()))
+            return { "channel": channel, "ts": "{}.000000".format(self.ts) }
+
+    def chat_update(self, channel, ts, text, **rest):
+        with self.lock:
+            self.updated.append((channel, ts, text, time.monotonic()))
+            return { "channel": channel, "ts": ts }
+
+def unlimited(outbound, *channels):
+    for channel in channels:
+        outbound.post_buckets[channel] = TokenBucket(1000, 1000)
+
+class TestOutboundQueue(unittest.TestCase):
+    def setUp(self):
+        self.webclient = FakeWebClient()
+        self.scheduler = Scheduler()
+        self.scheduler.start()
+        self.outbound = OutboundQueue(self.webclient, self.scheduler)
+
+    def tearDown(self):
+        self.outbound.stop()
+        self.scheduler.stop()
+
+    def post(self, channel, text):
+        return self.outbound.post_message(lambda response: (response["channel"], response["ts"]),
+                channel = channel, text = text)
+
+    def test_messages_to_a_channel_go_out_in_order(self):
+        unlimited(self.outbound, "C1", "C2")
+        futures = []
+        for i in range(20):
+            futures.append(self.post("C1", "one-{}".format(i)))
+            futures.append(self.post("C2", "two-{}".format(i)))
+        for f in futures:
+            f.result(5)
+
+        for channel, prefix in [("C1", "one"), ("C2", "two")]:
+            texts = [text for c, text, _ in self.webclient.posted if c == channel]
+            self.assertEqual(texts, ["{}-{}".format(prefix, i) for i in range(20)])
+
+    def test_future_resolves_to_the_posted_message(self):
+        channel, ts = self.post("C1", "hello").result(5)
+        self.assertEqual(channel, "C1")
+        self.assertEqual(ts, "1.000000")
+
+    def test_rate_limited_posts_retry_after_retry_after(self):
+        unlimited(self.outbound, "C1")
+        self.webclient.failures = [FakeResponse(429, { "Retry-After": "1" })]
+
+        start = time.monotonic()
+        first = self.post("C1", "first")
+        second = self.post("C1", "second")
+        first.result(5)
+        second.result(5)
+
+        self.assertEqual([text for _, text, _ in self.webclient.posted], ["first", "second"])
+        self.assertGreaterEqual(self.webclient.posted[0][2] - start, 1)
+
+    def test_other_failures_fail_the_future(self):
+        self.webclient.failures = [FakeResponse(500)]
+        with self.assertRaises(SlackApiError):
+            self.post("C1", "lost").result(5)
+        # and the channel carries on
+        self.assertEqual(self.post("C1", "next").result(5)[0], "C1")
+
+    def test_failing_response_handler_fails_the_future(self):
+        def broken(response):
+            raise KeyError("ts")
+
+        with self.assertRaises(KeyError):
+            self.outbound.post_message(broken, channel = "C1", text = "lost").result(5)
+        # and the channel's worker carries on
+        self.assertEqual(self.post("C1", "next").result(5)[0], "C1")
+
+    def update(self, text):
+        return self.outbound.update_message(lambda response: response["ts"],
+                channel = "C1", ts = "1.000000", text = text)
+
+    def test_burst_of_updates_is_sent_once(self):
+        futures = [self.update("edit-{}".format(i)) for i in range(5)]
+        for f in futures:
+            self.assertEqual(f.result(5), "1.000000")
+
+        self.assertEqual([text for _, _, text, _ in self.webclient.updated], ["edit-4"])
+        self.assertEqual(self.outbound.coalesced, 4)
+
+        # once that's gone out, the next update is sent too
+        self.update("later").result(5)
+        self.assertEqual([text for _, _, text, _ in self.webclient.updated], ["edit-4", "later"])
+
+    def test_held_updates_dont_hold_up_posts(self):
+        start = time.monotonic()
+        update = self.update("edit")
+        self.post("C1", "after the edit").result(5)
+        self.assertLess(time.monotonic() - start, UPDATE_DEBOUNCE / 2)
+
+        update.result(5)
+        self.assertGreater(self.webclient.updated[0][3], self.webclient.posted[0][2])
+
+    def test_stop_sends_held_updates(self):
+        self.update("edit")
+        self.outbound.stop()
+        self.assertEqual([text for _, _, text, _ in self.webclient.updated], ["edit"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import heapq
+import itertools
+import sys
+import threading
+import time
+import traceback
+
+class Timer():
+    def __init__(self, when, fn, interval):
+        self.when = when
+        self.fn = fn
+        self.interval = interval # None for one-shot timers
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class Scheduler():
+    """
+    Runs callbacks at (wall-clock) deadlines, on its own thread
+
+    Deadlines are kept in a heap, so the thread sleeps until exactly the next
+    one is due. Cancelled timers are dropped when they reach the top.
+    """
+    def __init__(self):
+        self.heap = [] # (when, seq, Timer)
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def call_at(self, when, fn):
+        return self._add(Timer(when, fn, None))
+
+    def call_later(self, delay, fn):
+        return self.call_at(time.time() + delay, fn)
+
+    def call_every(self, interval, fn):
+        return self._add(Timer(time.time() + interval, fn, interval))
+
+    def _add(self, timer):
+        with self.cond:
+            heapq.heappush(self.heap, (timer.when, next(self.seq), timer))
+            self.cond.notify()
+        return timer
+
+    def start(self):
+        self.thread = threading.Thread(target = self._run, name = "scheduler", daemon = True)
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+
+    def _next_due(self):
+        with self.cond:
+            while not self.stopped:
+                if not self.heap:
+                    self.cond.wait()
+                    continue
+
+                when, _, timer = self.heap[0]
+                if timer.cancelled:
+                    heapq.heappop(self.heap)
+                    continue
+
+                delay = when - time.time()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+
+                heapq.heappop(self.heap)
+                if timer.interval is not None:
+                    timer.when += timer.interval
+                    heapq.heappush(self.heap, (timer.when, next(self.seq), timer))
+                return timer
+        return None
+
+    def _run(self):
+        while True:
+            timer = self._next_due()
+            if timer is None:
+                return
+            try:
+                timer.fn()
+            except Exception as e:
+                print("\7error running scheduled callback: {}".format(e), file=sys.stderr)
+                traceback.print_exc()
@@ -0,0 +1,38 @@
+import unittest
+import threading
+
+from scheduler import Scheduler
+
+class TestScheduler(unittest.TestCase):
+    def test_one_shot_timers_fire_in_deadline_order(self):
+        scheduler = Scheduler()
+        scheduler.start()
+
+        fired = []
+        done = threading.Event()
+        scheduler.call_later(0.2, lambda: (fired.append("late"), done.set()))
+        scheduler.call_later(0.1, lambda: fired.append("early"))
+        scheduler.call_later(0.05, lambda: fired.append("cancelled")).cancel()
+
+        self.assertTrue(done.wait(5))
+        scheduler.stop()
+        self.assertEqual(fired, ["early", "late"])
+
+    def test_periodic_timer_repeats(self):
+        scheduler = Scheduler()
+        scheduler.start()
+
+        count = [0]
+        done = threading.Event()
+        def tick():
+            count[0] += 1
+            if count[0] == 3:
+                done.set()
+        timer = scheduler.call_every(0.02, tick)
+
+        self.assertTrue(done.wait(5))
+        timer.cancel()
+        scheduler.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,10 @@
 import sys
 import time
 import socket
+import threading
 import traceback
-import json
 
 from slack import RTMClient, WebClient
-from slack.errors import SlackApiError
 import aiohttp
 #import websocket
 #import slackclient
@@ -17,10 +16,14 @@ from msg.slackreaction import SlackReaction
 from msg.slackdeletion import SlackDeletion
 from bots.bot import USER_RE, lookup_user
 from bots.ps4.formatting import format_user
+from channelcache import ChannelCache
+from userdirectory import UserDirectory
+from outbound import OutboundQueue
+from dispatcher import Dispatcher, REPORT_INTERVAL
+from scheduler import Scheduler
 
 MSG_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
 PING_TIMEOUT = 10
-CHANNELS_FILE = "channels-cache.json"
 
 def ENCODE(s):
     if s is None:
@@ -37,7 +40,7 @@ class SlackMonitorConnectError(Exception):
     pass
 
 class SlackMonitor():
-    def __init__(self, socketclient, webclient):
+    def __init__(self, socketclient, webclient, concurrent = False):
         self.socketclient = socketclient
         self.webclient = webclient
         self.handlers = dict()
@@ -45,7 +48,14 @@ class SlackMonitor():
         self.idle_timeout = 5 * 60 # seconds
         self.timeout_timeout = 3 * 60 # seconds
 
-        self.channels = None
+        self.scheduler = Scheduler()
+        self.channels = ChannelCache(webclient, scheduler = self.scheduler)
+        self.users = UserDirectory(webclient)
+        # None: run handlers in turn, under handler_lock
+        self.dispatcher = Dispatcher() if concurrent else None
+        self.handler_lock = threading.RLock()
+        self.outbound = OutboundQueue(webclient, self.scheduler)
+        self.last_handled = time.time()
 
     def add_handler_for_channel(self, handler, channel):
         if channel == '*':
@@ -63,25 +73,69 @@ class SlackMonitor():
             print('\7error running handler "{}": {}'.format(handler.botname, e), file=sys.stderr)
             traceback.print_exc()
 
+    def dispatch(self, handler, channel, cb):
+        """
+        Runs cb(handler), with the handler's current channel set (unless channel is None)
+        """
+        def in_channel(handler):
+            if channel is not None:
+                handler.set_current_channel(channel)
+            cb(handler)
+
+        if self.dispatcher is None:
+            # events and timers arrive on different threads
+            with self.handler_lock:
+                self.run_handler(handler, in_channel)
+        else:
+            self.dispatcher.dispatch(handler, lambda: self.run_handler(handler, in_channel))
+
+    def call_at(self, handler, when, fn):
+        """
+        Schedules fn() for `when` (seconds since the epoch), run as one of handler's handlers
+        """
+        return self.scheduler.call_at(when, lambda: self.dispatch(handler, None, lambda _: fn()))
+
     def run_handlers(self, channel, cb):
         handled = False
 
         for handler in self.allhandlers:
             handled = True
-            handler.set_current_channel(channel)
-            self.run_handler(handler, cb)
+            self.last_handled = time.time()
+            self.dispatch(handler, channel, cb)
 
         if channel["name"] not in self.handlers:
             return handled
 
         handled = True
+        self.last_handled = time.time()
 
         for handler in self.handlers[channel["name"]]:
-            handler.set_current_channel(channel)
-            self.run_handler(handler, cb)
+            self.dispatch(handler, channel, cb)
 
         return handled
 
+    def bots(self):
+        bots = list(self.allhandlers)
+        for channel in self.handlers:
+            for bot in self.handlers[channel]:
+                if bot not in bots:
+                    bots.append(bot)
+        return bots
+
+    def run_idle(self):
+        if time.time() - self.last_handled < self.idle_timeout:
+            return
+
+        def handler(bot):
+            if bot.channel is not None:
+                bot.idle()
+        for bot in self.bots():
+            self.dispatch(bot, None, handler)
+
+    def run_timeout(self):
+        for bot in self.bots():
+            self.dispatch(bot, None, lambda bot: bot.timeout())
+
     def handle_reaction(self, slack_message, user, when, removed=False):
         item = slack_message.get('item')
 
@@ -96,6 +150,8 @@ class SlackMonitor():
         reaction = SlackReaction(emoji, user, channel, original_msg_time, when)
 
         def dispatch(handler):
+            if not handler.wants_reaction(channel_id, original_msg_time):
+                return
             if removed:
                 handler.handle_unreaction(reaction)
             else:
@@ -107,58 +163,22 @@ class SlackMonitor():
         deletion = SlackDeletion(deleted_ts, when, user, channel, deleted_text)
         return self.run_handlers(channel, lambda handler: handler.handle_deletion(deletion))
 
-    def _load_channels_file(self):
-        with open(CHANNELS_FILE, "r") as f:
-            self.channels = json.load(f)
-
-    def _load_channels_api(self):
-        print("fetching channels...")
-        channels = []
-        client = self.webclient
-        args = {
-            "types": "public_channel,private_channel",
-        }
-
-        while True:
-            while True:
-                try:
-                    response = client.conversations_list(**args)
-                    break
-                except SlackApiError as e:
-                    print(f'sleeping (error - {e})')
-                    time.sleep(60)
-
-            channels.extend(response.get('channels', []))
-            next_cursor = response.get('response_metadata', {}).get('next_cursor')
-            if not next_cursor:
-                break
-            args["cursor"] = next_cursor
-
-        self.channels = channels
-        print("fetched channels")
-
-    def _cache_channels(self):
-        with open(CHANNELS_FILE, "w") as f:
-            json.dump(self.channels, f)
-
     def lookup_channel(self, channel_id):
-        if self.channels is None:
-            try:
-                self._load_channels_file()
-            except FileNotFoundError:
-                self._load_channels_api()
-                self._cache_channels()
-            assert self.channels
-
-        for i in self.channels:
-            if i["id"] == channel_id:
-                return i
-        return None
+        return self.channels.lookup(channel_id)
+
+    def handle_channel_event(self, event, subevent):
+        if subevent == "channel_created":
+            self.channels.add(event["channel"])
+        elif subevent == "channel_rename":
+            channel = event["channel"]
+            self.channels.rename(channel["id"], channel["name"])
+        elif subevent == "channel_deleted":
+            self.channels.remove(event["channel"])
 
     def filter_usernames(self, text):
         def replace_user(match):
             id = match.group(1)
-            name = lookup_user(self.socketclient, id)
+            name = lookup_user(self, id)
             if name:
                 return format_user(name)
             return match.group(0)
@@ -283,10 +303,6 @@ class SlackMonitor():
 
 
     def run(self):
-        idle_time = 0
-        timeout_time = 0
-        ping_time = 0
-
         @RTMClient.run_on(event="message")
         def on_message(**payload):
             self.handle_slack_event(payload["data"])
@@ -299,6 +315,32 @@ class SlackMonitor():
         def on_unreact(**payload):
             self.handle_slack_event(payload["data"], "reaction_removed")
 
+        @RTMClient.run_on(event="user_change")
+        def on_user_change(**payload):
+            self.users.update(payload["data"]["user"])
+
+        @RTMClient.run_on(event="team_join")
+        def on_team_join(**payload):
+            self.users.update(payload["data"]["user"])
+
+        @RTMClient.run_on(event="channel_created")
+        def on_channel_created(**payload):
+            self.handle_channel_event(payload["data"], "channel_created")
+
+        @RTMClient.run_on(event="channel_rename")
+        def on_channel_rename(**payload):
+            self.handle_channel_event(payload["data"], "channel_rename")
+
+        @RTMClient.run_on(event="channel_deleted")
+        def on_channel_deleted(**payload):
+            self.handle_channel_event(payload["data"], "channel_deleted")
+
+        self.scheduler.call_every(self.idle_timeout, self.run_idle)
+        self.scheduler.call_every(self.timeout_timeout, self.run_timeout)
+        if self.dispatcher is not None:
+            self.scheduler.call_every(REPORT_INTERVAL, self.dispatcher.report)
+        self.scheduler.start()
+
         while True:
             try:
                 self.socketclient.start()
@@ -306,42 +348,16 @@ class SlackMonitor():
                 print(e)
                 print("disconnected, reconnecting...")
 
-        # unreachable
-        return
-
-        while True:
-            if self.guard(lambda: self.handle_slack_messages()):
-                # handled something, reset idle time
-                idle_time = 0
-
-            delay = 0.5
-            time.sleep(delay)
-            idle_time += delay
-            timeout_time += delay
-            ping_time += delay
-
-            if idle_time >= self.idle_timeout:
-                def handler(bot):
-                    if bot.channel is not None:
-                        bot.idle()
-                self.guard(lambda: self.iterate_bots(lambda bot: self.run_handler(bot, handler)))
-                idle_time = 0
-
-            if timeout_time >= self.timeout_timeout:
-                def handler(bot):
-                    bot.timeout()
-                self.guard(lambda: self.iterate_bots(lambda bot: self.run_handler(bot, handler)))
-                timeout_time = 0
-
-            if ping_time >= PING_TIMEOUT:
-                self.guard(self.ping)
-                ping_time = 0
-
-
     def iterate_bots(self, fn):
         for channel in self.handlers:
             for bot in self.handlers[channel]:
                 fn(bot)
 
     def teardown(self):
+        self.scheduler.stop()
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
         self.iterate_bots(lambda bot: bot.teardown())
+        self.users.save()
+        self.channels.flush()
+        self.outbound.stop()
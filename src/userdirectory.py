@@ -0,0 +1,130 @@
+from collections import OrderedDict
+import json
+import sys
+import threading
+import time
+
+from slack.errors import SlackApiError
+
+USERS_FILE = "users-cache.json"
+USERS_FILE_VERSION = 1
+MAX_USERS = 20000
+MISS_TTL = 10 * 60 # seconds, before retrying an id slack couldn't tell us about
+
+class UserDirectory():
+    """
+    id => name for workspace users, bulk loaded from USERS_FILE (or users_list)
+
+    Holds at most max_users names, evicting the least recently looked up.
+    Anything we don't have is fetched on demand with users_info.
+    """
+    def __init__(self, webclient, max_users = MAX_USERS):
+        self.webclient = webclient
+        self.max_users = max_users
+        self.names = None # OrderedDict, id => name, least recently used first
+        self.misses = dict() # id => time
+        self.partial = False # users_list failed part way - don't save, so we try again next start
+        self.lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self.names is None:
+            try:
+                self.load()
+            except FileNotFoundError:
+                self.load_api()
+                self.save()
+        return self.names
+
+    def load(self):
+        with open(USERS_FILE, "r") as f:
+            cached = json.load(f)
+
+        self.names = OrderedDict()
+        if cached.get("version") != USERS_FILE_VERSION:
+            print("unknown {} version {}, ignoring".format(USERS_FILE, cached.get("version")), file=sys.stderr)
+            return
+
+        for id, name in cached["users"]:
+            self._store(id, name)
+
+    def load_api(self):
+        print("fetching users...")
+        self.names = OrderedDict()
+        self.partial = False
+        args = {}
+
+        while True:
+            try:
+                response = self.webclient.users_list(**args)
+            except SlackApiError as e:
+                print("couldn't fetch users: {}".format(e), file=sys.stderr)
+                self.partial = True
+                break
+
+            for user in response.get("members", []):
+                self._store(user["id"], user["name"])
+
+            next_cursor = response.get("response_metadata", {}).get("next_cursor")
+            if not next_cursor:
+                break
+            args["cursor"] = next_cursor
+
+        print("fetched users")
+
+    def save(self):
+        if self.partial:
+            return
+        with self.lock:
+            users = list(self.names.items())
+        try:
+            with open(USERS_FILE, "w") as f:
+                json.dump({ "version": USERS_FILE_VERSION, "users": users }, f, separators=(",", ":"))
+        except IOError as e:
+            print("exception saving users: {}".format(e), file=sys.stderr)
+
+    def _store(self, id, name):
+        self.names[id] = name
+        self.names.move_to_end(id)
+        while len(self.names) > self.max_users:
+            self.names.popitem(last = False)
+        self.misses.pop(id, None)
+
+    def fetch(self, id):
+        try:
+            response = self.webclient.users_info(user = id)
+        except SlackApiError as e:
+            print("couldn't fetch user {}: {}".format(id, e), file=sys.stderr)
+            return None
+
+        user = response.get("user")
+        if not user:
+            return None
+        return user["name"]
+
+    def lookup(self, id):
+        names = self._ensure_loaded()
+
+        with self.lock:
+            name = names.get(id)
+            if name is not None:
+                names.move_to_end(id)
+                return name
+            if time.time() - self.misses.get(id, 0) < MISS_TTL:
+                return None
+
+        name = self.fetch(id)
+        with self.lock:
+            if name is None:
+                self.misses[id] = time.time()
+                return None
+            self._store(id, name)
+        return name
+
+    def update(self, user):
+        """
+        Handles a user_change (or team_join) event's user object
+        """
+        self._ensure_loaded()
+        with self.lock:
+            self._store(user["id"], user["name"])
+        self.save()
@@ -0,0 +1,94 @@
+import unittest
+import os
+import tempfile
+import time
+
+from slack.errors import SlackApiError
+
+from userdirectory import UserDirectory, USERS_FILE
+
+class FakeWebClient():
+    def __init__(self, users, pages = 1):
+        self.users = users # id => name
+        self.pages = pages
+        self.fail_page = None
+        self.calls = []
+
+    def users_list(self, cursor = "0"):
+        self.calls.append("users_list")
+        page = int(cursor)
+        if page == self.fail_page:
+            raise SlackApiError("ratelimited", { "ok": False })
+
+        ids = sorted(self.users)[page::self.pages]
+        response = { "members": [{ "id": id, "name": self.users[id] } for id in ids] }
+        if page + 1 < self.pages:
+            response["response_metadata"] = { "next_cursor": str(page + 1) }
+        return response
+
+    def users_info(self, user):
+        self.calls.append(("users_info", user))
+        if user not in self.users:
+            raise SlackApiError("user_not_found", { "ok": False })
+        return { "user": { "id": user, "name": self.users[user] } }
+
+class TestUserDirectory(unittest.TestCase):
+    def setUp(self):
+        # USERS_FILE is relative
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.webclient = FakeWebClient({ "U1": "tim", "U2": "ann", "U3": "bob" }, pages = 2)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_bulk_loads_then_serves_from_cache(self):
+        users = UserDirectory(self.webclient)
+        self.assertEqual([users.lookup(id) for id in ["U1", "U2", "U3"]], ["tim", "ann", "bob"])
+        self.assertEqual(self.webclient.calls, ["users_list", "users_list"])
+
+        # persisted - a new directory doesn't go back to slack
+        reloaded = UserDirectory(self.webclient)
+        self.assertEqual(reloaded.lookup("U2"), "ann")
+        self.assertEqual(self.webclient.calls, ["users_list", "users_list"])
+
+    def test_misses_fetch_once(self):
+        users = UserDirectory(self.webclient)
+        users.lookup("U1")
+
+        self.webclient.users["U4"] = "new"
+        self.assertEqual(users.lookup("U4"), "new")
+        self.assertEqual(users.lookup("U4"), "new")
+        self.assertIsNone(users.lookup("U9"))
+        self.assertIsNone(users.lookup("U9"))
+        self.assertEqual(self.webclient.calls[2:], [("users_info", "U4"), ("users_info", "U9")])
+
+        # until the miss expires
+        users.misses["U9"] = time.time() - 3600
+        users.lookup("U9")
+        self.assertEqual(self.webclient.calls[-1], ("users_info", "U9"))
+
+    def test_evicts_least_recently_looked_up(self):
+        users = UserDirectory(self.webclient, max_users = 2)
+        users.lookup("U3")
+        users.lookup("U1") # U2 is now the oldest
+        users.update({ "id": "U4", "name": "new" })
+        self.assertEqual(list(users.names), ["U1", "U4"])
+
+    def test_partial_list_is_not_saved(self):
+        self.webclient.fail_page = 1
+        users = UserDirectory(self.webclient)
+        self.assertEqual(users.lookup("U1"), "tim")
+        users.update({ "id": "U4", "name": "new" })
+        self.assertFalse(os.path.exists(USERS_FILE))
+
+        # the next start lists everyone again
+        self.webclient.fail_page = None
+        reloaded = UserDirectory(self.webclient)
+        self.assertEqual(reloaded.lookup("U2"), "ann")
+        self.assertTrue(os.path.exists(USERS_FILE))
+
+if __name__ == '__main__':
+    unittest.main()